@@ -0,0 +1,279 @@
+import asyncio
+import json
+import threading
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only required by the async transport.
+    aiohttp = None
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin import metrics
+from external_plugins.zendesk_plugin import rate_limit
+from external_plugins.zendesk_plugin import transformer_functions
+
+# One client per (url, email) and event loop. aiohttp sessions cannot be
+# shared across loops.
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Event loop thread behind the blocking adapters, started on first use.
+_loop = None
+_loop_lock = threading.Lock()
+_adapters = {}
+
+
+class AsyncRestApi(object):
+    """asyncio counterpart of ASyncRestApi on a shared aiohttp session with
+    a bounded connection pool.
+    """
+
+    def __init__(self, url, headers, limit=None):
+        if aiohttp is None:
+            raise ImportError("The async Zendesk transport requires aiohttp.")
+
+        self.url = url.rstrip("/")
+        self.headers = headers
+        self.limit = limit or DEFAULT.ASYNC_CONNECTION_LIMIT
+        self._session = None
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                raise_for_status=False)
+        return self._session
+
+    async def request(self, method, path, payload=None):
+        """Send through the instance rate limiter shared with the blocking
+        clients. Tokens are waited for with asyncio.sleep so the event loop
+        keeps running; a 429 pauses the limiter for every caller.
+        """
+        limiter = rate_limit.get_limiter(transformer_functions.instance_key(self))
+        lane_name = rate_limit.current_lane()
+        endpoint = metrics.endpoint(path) if metrics.enabled else None
+        attempt = 0
+
+        while True:
+            wait = limiter.try_acquire(lane_name)
+            while wait:
+                await asyncio.sleep(wait)
+                wait = limiter.try_acquire(lane_name)
+
+            try:
+                return await self.send(method, path, payload)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 429 or attempt >= DEFAULT.RATE_LIMIT_MAX_RETRIES:
+                    raise
+                limiter.pause(rate_limit.retry_delay(e.headers or {}, attempt), endpoint)
+                attempt += 1
+
+    async def send(self, method, path, payload=None):
+        """One request, without rate limiting or retries. Body sizes are
+        recorded as sent and received.
+        """
+        url = "{}/{}".format(self.url, path)
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+
+        async with self.session().request(method, url, data=data) as response:
+            rate_limit.get_limiter(transformer_functions.instance_key(self)).observe(response.headers)
+            response.raise_for_status()
+            body = await response.read()
+
+        if metrics.enabled:
+            metrics.record_bytes(method.lower(), path, len(data or b""), len(body))
+        return json.loads(body)
+
+    async def get(self, path):
+        return await self.request("GET", path)
+
+    async def put(self, path, payload):
+        return await self.request("PUT", path, payload)
+
+    async def post(self, path, payload):
+        return await self.request("POST", path, payload)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def connect(instance_details):
+    """Async client for the instance, shared by every caller on the running
+    event loop. Inbound, Outbound and AssetsManage can use it in place of
+    transformer_functions.connect with the same instance details.
+    """
+    loop = asyncio.get_running_loop()
+    key = (instance_details['url'], instance_details['email'], loop)
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None or client.password != instance_details['password']:
+            token = "Basic " + transformer_functions.encode_to_base64_string(
+                instance_details['email'],
+                instance_details['password']
+            )
+            header = {
+                'Authorization': token,
+                'Content-Type': 'application/json',
+                "Accept": "application/json",
+            }
+            client = AsyncRestApi(instance_details['url'], header)
+            client.password = instance_details['password']
+            _clients[key] = client
+            transformer_functions.register_instance(client, *key[:2])
+        return client
+
+
+class BlockingRestApi(object):
+    """ASyncRestApi compatible blocking client over an AsyncRestApi, for
+    Inbound, Outbound and AssetsManage. Requests run on a background event
+    loop shared by every adapter. Rate limiting and 429 retries are left to
+    transformer_functions.request, as for the default client.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, path):
+        return run(self.client.send("GET", path))
+
+    def put(self, path, payload):
+        return run(self.client.send("PUT", path, payload))
+
+    def post(self, path, payload):
+        return run(self.client.send("POST", path, payload))
+
+
+def background_loop():
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+        return _loop
+
+
+def run(coroutine):
+    """Run ``coroutine`` on the background event loop and wait for it."""
+    return asyncio.run_coroutine_threadsafe(coroutine, background_loop()).result()
+
+
+def blocking_connect(instance_details):
+    """BlockingRestApi for the instance, sharing the background loop's
+    AsyncRestApi and the instance rate limiter.
+    """
+    async def client():
+        return connect(instance_details)
+
+    async_client = run(client())
+    key = (instance_details['url'], instance_details['email'])
+
+    with _clients_lock:
+        adapter = _adapters.get(key)
+        if adapter is None or adapter.client is not async_client:
+            adapter = _adapters[key] = BlockingRestApi(async_client)
+            transformer_functions.register_instance(adapter, *key)
+        return adapter
+
+
+def transport_connect(instance_details):
+    """Client for the synchronous plugin classes: the blocking adapter over
+    the aiohttp transport when ASYNC_TRANSPORT_ENABLED, otherwise the pooled
+    default client.
+    """
+    if DEFAULT.ASYNC_TRANSPORT_ENABLED:
+        return blocking_connect(instance_details)
+    return transformer_functions.connect(instance_details)
+
+
+async def close_all():
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = [key for key in _clients if key[2] is loop]
+        clients = [_clients.pop(key) for key in clients]
+    for client in clients:
+        await client.close()
+
+
+def api_path(instance_path):
+    return "{}/{}/{}".format(
+        DEFAULT.INITIAL_PATH,
+        DEFAULT.REST_ENDPOINT_VERSION,
+        instance_path)
+
+
+async def check_connection(instance):
+    response = await instance.get(api_path("organizations"))
+
+    if "organizations" in response:
+        return "Connection to Zendesk server is successfull."
+    else:
+        return "Can not establish connection to Zendesk server."
+
+
+async def paginate(instance, instance_path, key, page_size=None):
+    separator = "&" if "?" in instance_path else "?"
+    path = "{}{}page[size]={}".format(
+        api_path(instance_path), separator, page_size or DEFAULT.PAGE_SIZE)
+
+    while path:
+        response = await instance.get(path)
+
+        for record in response[key]:
+            yield record
+
+        if "meta" in response:
+            has_more = response["meta"].get("has_more")
+            path = (transformer_functions.relative_path(response["links"]["next"])
+                    if has_more else None)
+        else:
+            next_page = response.get("next_page")
+            path = transformer_functions.relative_path(next_page) if next_page else None
+
+
+async def resource(instance, plural, singular, id=None, payload=None, allow_put=True):
+    instance_path = "{}/{}".format(plural, id) if id else plural
+    path = api_path(instance_path)
+
+    if payload:
+        if id and allow_put:
+            response = await instance.put(path, payload)
+        else:
+            response = await instance.post(path, payload)
+        return response[singular]
+    else:
+        if id:
+            return (await instance.get(path))[singular]
+        return [record async for record in paginate(instance, plural, plural)]
+
+
+async def tickets(instance, id=None, payload=None):
+    return await resource(instance, "tickets", "ticket", id, payload)
+
+
+async def ticket_fields(instance, id=None, payload=None):
+    response = await resource(instance, "ticket_fields", "ticket_field", id, payload)
+    if payload:
+        transformer_functions.invalidate_metadata(instance)
+    return response
+
+
+async def webhooks(instance, id=None, payload=None):
+    return await resource(instance, "webhooks", "webhook", id, payload)
+
+
+async def trigger_categories(instance, id=None, payload=None):
+    return await resource(instance, "trigger_categories", "trigger_category",
+                          id, payload, allow_put=False)
+
+
+async def triggers(instance, id=None, payload=None):
+    return await resource(instance, "triggers", "trigger", id, payload)
+
+
+async def get_user_by_email(instance, email):
+    instance_path = "search?query=type:user \"{}\"".format(email)
+    return await instance.get(api_path(instance_path))
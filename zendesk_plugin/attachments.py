@@ -0,0 +1,179 @@
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import requests
+except ImportError:  # requests is only required for attachment transfer.
+    requests = None
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin import metrics
+from external_plugins.zendesk_plugin import rate_limit
+from external_plugins.zendesk_plugin import transformer_functions
+from external_plugins.zendesk_plugin.cache import TTLCache
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Content hashes already attached to a ticket, keyed by (url, ticket id).
+_synced_hashes = TTLCache(DEFAULT.ATTACHMENT_DEDUPE_TTL,
+                          DEFAULT.ATTACHMENT_DEDUPE_SIZE)
+_synced_hashes_lock = threading.Lock()
+
+
+def authorization(instance_details):
+    return "Basic " + transformer_functions.encode_to_base64_string(
+        instance_details['email'],
+        instance_details['password']
+    )
+
+
+def session(instance_details):
+    if requests is None:
+        raise ImportError("Zendesk attachment transfer requires requests.")
+
+    key = (instance_details['url'], instance_details['email'])
+    with _sessions_lock:
+        http = _sessions.get(key)
+        if http is None:
+            http = _sessions[key] = requests.Session()
+            http.headers['Authorization'] = authorization(instance_details)
+        return http
+
+
+def download(url, headers=None, http=None):
+    """Spool the attachment at ``url`` to a temporary file while hashing it.
+    Only ATTACHMENT_SPOOL_MEMORY bytes are kept in memory; the rest goes
+    to disk. Returns the rewound file and its SHA-256.
+    """
+    http = http or requests
+    digest = hashlib.sha256()
+    spooled = tempfile.SpooledTemporaryFile(max_size=DEFAULT.ATTACHMENT_SPOOL_MEMORY)
+
+    try:
+        with http.get(url, headers=headers, stream=True,
+                      timeout=DEFAULT.ATTACHMENT_TIMEOUT) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(DEFAULT.ATTACHMENT_CHUNK_SIZE):
+                digest.update(chunk)
+                spooled.write(chunk)
+    except Exception:
+        spooled.close()
+        raise
+
+    spooled.seek(0)
+    return spooled, digest.hexdigest()
+
+
+def upload(instance, instance_details, filename, stream, content_type=None):
+    """Stream ``stream`` to the uploads endpoint and return the upload token.
+    The upload goes through the instance rate limiter and is retried from
+    the start of ``stream`` on 429.
+    """
+    path = "{}/{}/uploads".format(DEFAULT.INITIAL_PATH, DEFAULT.REST_ENDPOINT_VERSION)
+    url = "{}/{}".format(instance_details['url'].rstrip("/"), path)
+    http = session(instance_details)
+    size = stream.seek(0, 2)
+
+    def post():
+        stream.seek(0)
+        response = http.post(
+            url,
+            params={"filename": filename},
+            data=stream,
+            headers={"Content-Type": content_type or "application/binary"},
+            timeout=DEFAULT.ATTACHMENT_TIMEOUT)
+        response.raise_for_status()
+        if metrics.enabled:
+            metrics.record_bytes("post", path, size, len(response.content))
+        return response.json()
+
+    return transformer_functions.send(instance, "post", path, post)["upload"]["token"]
+
+
+def synced_hashes(instance_details, ticket_id):
+    with _synced_hashes_lock:
+        return set(_synced_hashes.get((instance_details['url'], str(ticket_id))) or ())
+
+
+def mark_synced(instance_details, ticket_id, content_hashes):
+    """Remember that files with ``content_hashes`` are attached to the
+    ticket. Call only once the comment carrying their uploads is saved.
+    """
+    key = (instance_details['url'], str(ticket_id))
+    with _synced_hashes_lock:
+        synced = _synced_hashes.get(key)
+        if synced is None:
+            synced = set()
+            _synced_hashes.set(key, synced)
+        synced.update(content_hashes)
+
+
+def transfer(instance, instance_details, ticket_id, attachment, claim=None):
+    """Copy one attachment to Zendesk. Once the file is hashed,
+    ``claim(content_hash)`` decides whether it is uploaded. Returns (upload
+    token, content hash), or None when the file was skipped.
+    """
+    spooled, content_hash = download(attachment["url"], attachment.get("headers"),
+                                     attachment.get("session"))
+
+    with spooled:
+        if claim is not None and not claim(content_hash):
+            return None
+        token = upload(instance, instance_details, attachment["filename"], spooled,
+                       attachment.get("content_type"))
+        return token, content_hash
+
+
+def transfer_all(instance, instance_details, ticket_id, attachments):
+    """Transfer the attachments of one comment in parallel, leaving out files
+    already attached to the ticket and repeated files within the comment.
+    Returns the uploads as (token, content hash) pairs; pass the hashes to
+    mark_synced once the comment is saved.
+    """
+    if not attachments:
+        return []
+
+    # Each content hash is uploaded by the first worker that hashes it.
+    claimed = synced_hashes(instance_details, ticket_id)
+    claimed_lock = threading.Lock()
+
+    def claim(content_hash):
+        with claimed_lock:
+            if content_hash in claimed:
+                return False
+            claimed.add(content_hash)
+            return True
+
+    # Worker threads inherit the caller's priority lane.
+    lane_name = rate_limit.current_lane()
+
+    def copy(attachment):
+        with rate_limit.lane(lane_name):
+            return transfer(instance, instance_details, ticket_id, attachment, claim)
+
+    workers = min(DEFAULT.ATTACHMENT_WORKERS, len(attachments))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [upload for upload in executor.map(copy, attachments) if upload]
+
+
+def comment_attachments(instance_details, comments):
+    """Attachments of ``comments`` in the form expected by
+    :func:`transfer_all`. Each carries the credentials needed to download
+    its content_url from the instance.
+    """
+    headers = {"Authorization": authorization(instance_details)}
+
+    return [
+        {
+            "url": attachment["content_url"],
+            "filename": attachment["file_name"],
+            "content_type": attachment.get("content_type"),
+            "size": attachment.get("size"),
+            "headers": headers
+        }
+        for comment in comments
+        for attachment in comment.get("attachments", [])
+    ]
@@ -0,0 +1,228 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from external_plugins.zendesk_plugin import transformer_functions
+from external_plugins.zendesk_plugin import rate_limit
+import external_plugins.zendesk_plugin.default as DEFAULT
+
+CREATE = "create"
+UPDATE = "update"
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+class BatchWriteError(Exception):
+    pass
+
+
+class TicketWriteBatcher(object):
+    """Collects ticket writes from concurrent callers and sends them through
+    tickets/create_many and tickets/update_many.
+    """
+
+    def __init__(self, instance):
+        self.instance = instance
+        self._pending = {CREATE: [], UPDATE: []}
+        self._flush_now = False
+        self._condition = threading.Condition()
+        self._worker = None
+
+    def submit(self, operation, ticket):
+        return self.submit_many(operation, [ticket], flush=False)[0]
+
+    def submit_many(self, operation, tickets, flush=True):
+        """Queue many writes at once and return their futures, in order.
+        With ``flush`` the pending writes are sent right away instead of
+        waiting for the batch window.
+        """
+        if operation == UPDATE and any(ticket.get("id") is None for ticket in tickets):
+            raise BatchWriteError("Ticket updates need the ticket id.")
+
+        futures = [Future() for _ in tickets]
+        now = time.monotonic()
+
+        with self._condition:
+            self._pending[operation].extend(
+                (ticket, future, now) for ticket, future in zip(tickets, futures))
+            if flush:
+                self._flush_now = True
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._condition.notify()
+
+        return futures
+
+    def _run(self):
+        batches = {}
+        try:
+            while True:
+                with self._condition:
+                    if not self._has_pending():
+                        self._condition.wait(DEFAULT.OUTBOUND_BATCH_WINDOW)
+                        if not self._has_pending():
+                            self._worker = None
+                            return
+
+                    oldest = min(items[0][2] for items in self._pending.values() if items)
+                    deadline = oldest + DEFAULT.OUTBOUND_BATCH_WINDOW
+                    while not self._is_full() and not self._flush_now:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+
+                    batches = {operation: self._take(operation) for operation in self._pending}
+                    if not self._has_pending():
+                        self._flush_now = False
+
+                with rate_limit.lane(rate_limit.BULK):
+                    for operation, items in batches.items():
+                        if items:
+                            self._flush(operation, items)
+        except BaseException as e:
+            # Nothing may be left waiting on a worker that is gone.
+            with self._condition:
+                self._worker = None
+                items = [item for pending in self._pending.values() for item in pending]
+                for pending in self._pending.values():
+                    del pending[:]
+            for batch in batches.values():
+                items.extend(batch)
+            for _, future, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+
+    def _take(self, operation):
+        # Caller holds the condition.
+        items = self._pending[operation]
+        if operation == CREATE:
+            batch = items[:DEFAULT.OUTBOUND_BATCH_SIZE]
+            del items[:DEFAULT.OUTBOUND_BATCH_SIZE]
+            return batch
+
+        # update_many results only carry the ticket id, so a batch holds one
+        # write per ticket. Later writes to the ticket wait for the next
+        # batch, in order.
+        batch = []
+        waiting = []
+        ticket_ids = set()
+        for item in items:
+            ticket_id = str(item[0]["id"])
+            if ticket_id in ticket_ids or len(batch) >= DEFAULT.OUTBOUND_BATCH_SIZE:
+                waiting.append(item)
+            else:
+                batch.append(item)
+            ticket_ids.add(ticket_id)
+        items[:] = waiting
+        return batch
+
+    def _has_pending(self):
+        return any(self._pending.values())
+
+    def _is_full(self):
+        return any(len(items) >= DEFAULT.OUTBOUND_BATCH_SIZE
+                   for items in self._pending.values())
+
+    def _flush(self, operation, items):
+        try:
+            self._send(operation, items)
+        except Exception as e:
+            for _, future, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _send(self, operation, items):
+        tickets_payload = [ticket for ticket, _, _ in items]
+
+        try:
+            if operation == CREATE:
+                job = transformer_functions.tickets_create_many(
+                    self.instance, tickets_payload)
+            else:
+                job = transformer_functions.tickets_update_many(
+                    self.instance, tickets_payload)
+            job = self._wait_for_job(job)
+        except Exception as e:
+            for _, future, _ in items:
+                future.set_exception(e)
+            return
+
+        # create_many results carry the item index; update_many results only
+        # carry the ticket id, which is unique within the batch.
+        results = {}
+        for position, result in enumerate(job.get("results") or []):
+            if operation == CREATE:
+                results[result.get("index", position)] = result
+            else:
+                results[str(result.get("id"))] = result
+
+        for index, (ticket, future, _) in enumerate(items):
+            key = index if operation == CREATE else str(ticket["id"])
+            result = results.get(key)
+            if result is None:
+                future.set_exception(BatchWriteError(
+                    "Job [{}] returned no result for item [{}].".format(job.get("id"), key)))
+            elif result.get("error") or result.get("success") is False:
+                future.set_exception(BatchWriteError("{} {}".format(
+                    result.get("error", ""), result.get("details", "")).strip()))
+            else:
+                future.set_result(result)
+
+    def _wait_for_job(self, job):
+        deadline = time.monotonic() + DEFAULT.JOB_STATUS_TIMEOUT
+
+        while job["status"] in ("queued", "working"):
+            if time.monotonic() > deadline:
+                raise BatchWriteError(
+                    "Timed out waiting for job [{}].".format(job["id"]))
+            time.sleep(DEFAULT.JOB_STATUS_POLL_INTERVAL)
+            job = transformer_functions.job_statuses(self.instance, job["id"])
+
+        if job["status"] != "completed":
+            raise BatchWriteError("Job [{}] finished with status [{}]. {}".format(
+                job["id"], job["status"], job.get("message") or ""))
+
+        return job
+
+
+def get_batcher(instance, instance_details):
+    key = (instance_details['url'], instance_details['email'])
+
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = TicketWriteBatcher(instance)
+        else:
+            batcher.instance = instance
+        return batcher
+
+
+def write(instance, instance_details, operation, ticket):
+    """Queue a single ticket write and block until its batch has finished.
+    Returns the job result entry for this ticket. The caller waits for the
+    batch window and the job, so this only pays off with many concurrent
+    callers; callers holding many writes should use write_many.
+    """
+    future = get_batcher(instance, instance_details).submit(operation, ticket)
+    return future.result()
+
+
+def write_many(instance, instance_details, operation, tickets):
+    """Send many ticket writes at once and collect their job results, in
+    order. Writes go out in OUTBOUND_BATCH_SIZE chunks without waiting for
+    the batch window. A write that failed is returned as its exception, so
+    one bad ticket does not hide the results of the others.
+    """
+    futures = get_batcher(instance, instance_details).submit_many(operation, tickets)
+
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
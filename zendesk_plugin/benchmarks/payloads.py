@@ -0,0 +1,93 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin.mapping import trigger_payload
+
+TICKET_TYPES = ["incident", "problem", "question", "task"]
+STATUSES = ["new", "open", "pending", "solved"]
+
+
+def comment_html(updated_at, with_attachment):
+    """latest_comment_html as rendered by Zendesk: header with the update
+    time, a separator, the body and an optional attachment list.
+    """
+    html = ("Jane Customer, {}\n\n"
+            "----------------------------------------------\n\n"
+            "<p>The export still fails after the upgrade.</p>\n\n".format(
+                "{} {}, {}, {}".format(updated_at.strftime("%b"), updated_at.day,
+                                       updated_at.year, updated_at.strftime("%H:%M"))))
+    if with_attachment:
+        html += "Attachment(s):\nscreenshot.png - https://example.zendesk.com/attachments/token/abc\n"
+    return html
+
+
+class PayloadGenerator(object):
+    """Webhook bodies in the exact shape rendered by the AgilitySync trigger
+    templates for the given payload profile.
+
+    ``sync_user_ratio`` of the events are echoes written by the sync user
+    and ``comment_ratio`` carry a new comment.
+    """
+
+    def __init__(self, profile=None, host="example.zendesk.com", tickets=1000,
+                 sync_user_id="1", sync_user_ratio=0.1, comment_ratio=0.3,
+                 attachment_ratio=0.1, notes_size=2048, seed=0):
+        self.templates = {
+            as_trigger["webhook_type"]: trigger_payload(as_trigger["webhook_type"], profile=profile)
+            for as_trigger in DEFAULT.AS_TRIGGERS
+        }
+        self.host = host
+        self.tickets = tickets
+        self.sync_user_id = sync_user_id
+        self.sync_user_ratio = sync_user_ratio
+        self.comment_ratio = comment_ratio
+        self.attachment_ratio = attachment_ratio
+        self.notes = "x" * notes_size
+        self.random = random.Random(seed)
+        self.started = datetime(2026, 1, 1)
+
+    def event(self, action=None):
+        action = action or self.random.choice(sorted(self.templates))
+        ticket_id = self.random.randint(1, self.tickets)
+        updated_at = self.started + timedelta(minutes=self.random.randint(0, 500000))
+        commented = action == "comment_created" or self.random.random() < self.comment_ratio
+
+        comment = comment_html(updated_at if commented else updated_at - timedelta(days=1),
+                               self.random.random() < self.attachment_ratio)
+        ticket = {
+            "id": str(ticket_id),
+            "type": self.random.choice(TICKET_TYPES),
+            "status": self.random.choice(STATUSES),
+            "url": "{}/agent/tickets/{}".format(self.host, ticket_id),
+            "updated_at_with_time": "{} {}, {} at {}".format(
+                updated_at.strftime("%B"), updated_at.day, updated_at.year,
+                updated_at.strftime("%H:%M")),
+            "updated_at_with_timestamp": updated_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "latest_comment_html": comment,
+            "latest_public_comment_html": comment,
+            "organization": {"notes": self.notes, "details": self.notes}
+        }
+        user_id = (self.sync_user_id if self.random.random() < self.sync_user_ratio
+                   else str(self.random.randint(1000, 2000)))
+
+        event = json.loads(self.templates[action])
+        fill(event["ticket"], ticket)
+        fill(event["user"], {"id": user_id})
+        return event
+
+    def events(self, count):
+        return [self.event() for _ in range(count)]
+
+
+def fill(rendered, values):
+    # Only keys present in the template are kept, so the shape matches
+    # what Zendesk sends for the profile.
+    for key, value in rendered.items():
+        if isinstance(value, dict):
+            fill(value, values.get(key, {}))
+        elif key in values:
+            rendered[key] = values[key]
+        else:
+            rendered[key] = "{} value".format(key)
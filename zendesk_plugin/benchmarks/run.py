@@ -0,0 +1,446 @@
+"""Benchmark the Zendesk plugin against a local stub server.
+
+    python -m external_plugins.zendesk_plugin.benchmarks.run --output results.json
+
+Every scenario reports its operation count, elapsed seconds, operations per
+second and latency percentiles as JSON, so runs can be diffed.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin import metrics
+from external_plugins.zendesk_plugin import transformer_functions
+from external_plugins.zendesk_plugin.benchmarks.payloads import PayloadGenerator
+from external_plugins.zendesk_plugin.benchmarks.stub_server import StubZendesk
+
+
+def bind(cls, **attributes):
+    """Instance of a plugin class with the attributes the sync framework
+    would set, without going through the framework constructor.
+    """
+    obj = cls.__new__(cls)
+    obj.__dict__.update(attributes)
+    return obj
+
+
+def summarize(name, latencies, elapsed, **extra):
+    latencies = sorted(latencies)
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    result = {
+        "scenario": name,
+        "operations": len(latencies),
+        "elapsed": elapsed,
+        "per_second": len(latencies) / elapsed if elapsed else None,
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99)
+    }
+    result.update(extra)
+    return result
+
+
+def timed_calls(func, items, workers=1):
+    def call(item):
+        started = time.perf_counter()
+        func(item)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            latencies = list(executor.map(call, items))
+    else:
+        latencies = [call(item) for item in items]
+    return latencies, time.perf_counter() - started
+
+
+def inbound_classification(args):
+    """Cyclic check, event type, revision, timestamp and category of every
+    generated webhook; no network calls.
+    """
+    from external_plugins.zendesk_plugin.sync import Payload, Event, Inbound
+
+    generator = PayloadGenerator(profile=args.profile, seed=args.seed)
+    events = generator.events(args.events)
+    payload = bind(Payload)
+
+    def classify(event):
+        if payload.is_cyclic_event(event, generator.sync_user_id):
+            return
+        payload.fetch_asset(event)
+        parsed = bind(Event, event=event)
+        parsed.fetch_event_type()
+        parsed.fetch_workitem_id()
+        parsed.fetch_revision()
+        parsed.fetch_timestamp()
+        # Filling in missing field values needs the instance; the generated
+        # payloads are complete.
+        bind(Inbound, event=event, _event_completed=True).fetch_event_category()
+
+    latencies, elapsed = timed_calls(classify, events)
+    return summarize("inbound_classification", latencies, elapsed, profile=args.profile)
+
+
+def inbound_decode(args):
+    """Parse, validate and build the EventRecord of serialized webhooks."""
+    from external_plugins.zendesk_plugin import decode
+
+    generator = PayloadGenerator(profile=args.profile, seed=args.seed)
+    bodies = [json.dumps(event) for event in generator.events(args.events)]
+
+    latencies, elapsed = timed_calls(decode.decode, bodies)
+    return summarize("inbound_decode", latencies, elapsed, profile=args.profile,
+                     backend="orjson" if decode.orjson is not None else "json")
+
+
+def outbound_writes(args, stub, operation):
+    from external_plugins.zendesk_plugin.sync import Outbound
+
+    instance_details = {"url": stub.url, "email": "outbound@example.com", "password": "secret"}
+    instance = transformer_functions.connect(instance_details)
+    asset_info = {"asset": "task", "display_name": "Task"}
+
+    def write(index):
+        outbound = bind(Outbound, instance_details=instance_details, instance_object=instance,
+                        asset_info=asset_info, workitem_id=str(index % stub.tickets + 1))
+        fields = {"subject": "Benchmark {}".format(index), "type": "task"}
+        if operation == "create":
+            outbound.create(fields)
+        else:
+            outbound.update(fields)
+
+    latencies, elapsed = timed_calls(write, range(args.writes), args.workers)
+    return summarize("outbound_{}".format(operation), latencies, elapsed,
+                     workers=args.workers, batching=DEFAULT.OUTBOUND_BATCHING_ENABLED)
+
+
+def outbound_bulk_writes(args, stub, operation):
+    """``--writes`` ticket writes sent through batching.write_many, one call
+    per OUTBOUND_BATCH_SIZE tickets. Latencies are per call.
+    """
+    from external_plugins.zendesk_plugin import batching
+
+    instance_details = {"url": stub.url, "email": "bulk@example.com", "password": "secret"}
+    instance = transformer_functions.connect(instance_details)
+
+    def ticket(index):
+        fields = {"subject": "Benchmark {}".format(index), "type": "task"}
+        if operation == batching.UPDATE:
+            fields["id"] = index % stub.tickets + 1
+        return fields
+
+    chunks = [
+        [ticket(index) for index in range(start, min(start + DEFAULT.OUTBOUND_BATCH_SIZE, args.writes))]
+        for start in range(0, args.writes, DEFAULT.OUTBOUND_BATCH_SIZE)
+    ]
+    failed = []
+
+    def write(chunk):
+        results = batching.write_many(instance, instance_details, operation, chunk)
+        failed.extend(result for result in results if isinstance(result, Exception))
+
+    latencies, elapsed = timed_calls(write, chunks)
+    return summarize("outbound_bulk_{}".format(operation), latencies, elapsed,
+                     tickets=args.writes, tickets_per_second=args.writes / elapsed if elapsed else None,
+                     failed=len(failed))
+
+
+def attachment_transfer(args, stub):
+    """Copy comments of ``--attachments`` files of ``--attachment-size`` bytes
+    each through Outbound.attachment_create. Files are spooled to disk past
+    ATTACHMENT_SPOOL_MEMORY, so the peak Python heap must stay under the
+    reported ceiling however large the files are.
+    """
+    from external_plugins.zendesk_plugin.sync import Outbound
+
+    instance_details = {"url": stub.url, "email": "attachments@example.com", "password": "secret"}
+    instance = transformer_functions.connect(instance_details)
+    asset_info = {"asset": "task", "display_name": "Task"}
+    workers = min(DEFAULT.ATTACHMENT_WORKERS, args.attachments)
+
+    def comment(index, size):
+        outbound = bind(Outbound, instance_details=instance_details, instance_object=instance,
+                        asset_info=asset_info, workitem_id=str(index % stub.tickets + 1))
+        outbound.attachment_create([
+            {
+                "url": "{}/files/{}?seed={}-{}".format(stub.url, size, index, file),
+                "filename": "file{}.bin".format(file),
+                "content_type": "application/octet-stream"
+            }
+            for file in range(args.attachments)
+        ])
+
+    def traced(func):
+        tracemalloc.start()
+        try:
+            result = func()
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    # The fixed cost of the transfer path (clients, threads and the stub,
+    # which runs in this process), measured with single chunk files. On top
+    # of it each worker holds one in-memory spool and a chunk in flight,
+    # independent of the file size.
+    _, overhead = traced(lambda: [comment(index, DEFAULT.ATTACHMENT_CHUNK_SIZE)
+                                  for index in range(args.comments)])
+    ceiling = overhead + int(workers * (DEFAULT.ATTACHMENT_SPOOL_MEMORY +
+                                        DEFAULT.ATTACHMENT_CHUNK_SIZE) * 1.5)
+
+    uploaded = stub.uploaded_bytes
+    (latencies, elapsed), peak = traced(
+        lambda: timed_calls(lambda index: comment(index, args.attachment_size), range(args.comments)))
+
+    return summarize("attachment_transfer", latencies, elapsed,
+                     files_per_comment=args.attachments, file_size=args.attachment_size,
+                     uploaded_bytes=stub.uploaded_bytes - uploaded, peak_memory=peak,
+                     fixed_memory=overhead, memory_ceiling=ceiling, within_ceiling=peak <= ceiling)
+
+
+def transport_reads(args, stub):
+    """``--writes`` ticket reads through the default client on ``--workers``
+    threads, the blocking async adapter on the same threads and the async
+    client with ``--concurrency`` requests in flight on one event loop.
+    """
+    from external_plugins.zendesk_plugin import async_transformer_functions
+
+    ids = [index % stub.tickets + 1 for index in range(args.writes)]
+    results = []
+
+    for name, connect in (("sync", transformer_functions.connect),
+                          ("blocking_adapter", async_transformer_functions.blocking_connect)):
+        instance = connect({"url": stub.url, "email": "{}@example.com".format(name),
+                            "password": "secret"})
+        latencies, elapsed = timed_calls(
+            lambda id: transformer_functions.tickets(instance, id), ids, args.workers)
+        results.append(summarize("transport_{}".format(name), latencies, elapsed,
+                                 workers=args.workers))
+    async_transformer_functions.run(async_transformer_functions.close_all())
+
+    async def read_all():
+        instance = async_transformer_functions.connect(
+            {"url": stub.url, "email": "async@example.com", "password": "secret"})
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def read(id):
+            async with semaphore:
+                started = time.perf_counter()
+                await async_transformer_functions.tickets(instance, id)
+                return time.perf_counter() - started
+
+        try:
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*[read(id) for id in ids])
+            return latencies, time.perf_counter() - started
+        finally:
+            await async_transformer_functions.close_all()
+
+    latencies, elapsed = asyncio.run(read_all())
+    results.append(summarize("transport_async", latencies, elapsed, concurrency=args.concurrency))
+    return results
+
+
+def connection_pool(args, stub):
+    """``--writes`` connect-then-read calls on ``--workers`` threads, the way
+    every plugin entry point connects, with the client pool on and off.
+    Reports the TCP connections the stub accepted for each run.
+    """
+    pool_size = DEFAULT.CONNECTION_POOL_SIZE
+    ids = [index % stub.tickets + 1 for index in range(args.writes)]
+    results = []
+
+    for name, size in (("pooled", pool_size or 100), ("unpooled", 0)):
+        DEFAULT.CONNECTION_POOL_SIZE = size
+        transformer_functions.reset_connection_pool()
+        instance_details = {"url": stub.url, "email": "{}@example.com".format(name),
+                            "password": "secret"}
+
+        def read(id):
+            transformer_functions.tickets(transformer_functions.connect(instance_details), id)
+
+        connections = stub.connections
+        latencies, elapsed = timed_calls(read, ids, args.workers)
+        results.append(summarize("connection_{}".format(name), latencies, elapsed,
+                                 workers=args.workers, handshakes=stub.connections - connections))
+
+    DEFAULT.CONNECTION_POOL_SIZE = pool_size
+    transformer_functions.reset_connection_pool()
+    return results
+
+
+def pagination(args):
+    """Walk ``--records`` tickets with transformer_functions.iter_tickets and
+    reconcile the AS triggers among ``--records`` triggers, on a stub of
+    their own. Reports the peak Python heap of the streamed walk next to
+    that of a materialized list, and the requests reconcile_ticket_triggers
+    needs when the AS triggers come first.
+    """
+    from external_plugins.zendesk_plugin.mapping import (
+        reconcile_ticket_triggers,
+        trigger_webhook_action
+    )
+
+    webhook_id, category_id = "1", "2"
+    instance_details = {"url": None, "email": "pagination@example.com", "password": "secret"}
+    authorization = "Basic " + transformer_functions.encode_to_base64_string(
+        instance_details["email"], instance_details["password"])
+    results = []
+
+    with StubZendesk(tickets=args.records) as stub:
+        instance_details["url"] = stub.url
+        store = stub.store(authorization)
+        for as_trigger in DEFAULT.AS_TRIGGERS:
+            store.insert("triggers", {
+                "raw_title": as_trigger["title"],
+                "category_id": category_id,
+                "conditions": {},
+                "actions": [trigger_webhook_action(webhook_id, as_trigger["webhook_type"])]
+            })
+        for index in range(args.records):
+            store.insert("triggers", {"raw_title": "Trigger {}".format(index), "actions": []})
+
+        instance = transformer_functions.connect(instance_details)
+
+        for name, walk in (("streamed", lambda: sum(1 for _ in transformer_functions.iter_tickets(instance))),
+                           ("materialized", lambda: len(list(transformer_functions.iter_tickets(instance))))):
+            requests = stub.requests
+            tracemalloc.start()
+            try:
+                started = time.perf_counter()
+                records = walk()
+                elapsed = time.perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            results.append(summarize("pagination_{}".format(name), [elapsed], elapsed,
+                                     records=records, pages=stub.requests - requests,
+                                     peak_memory=peak))
+
+        requests = stub.requests
+        started = time.perf_counter()
+        reconcile_ticket_triggers(instance, webhook_id, category_id,
+                                  transformer_functions.iter_triggers(instance))
+        elapsed = time.perf_counter() - started
+        results.append(summarize("pagination_reconcile_triggers", [elapsed], elapsed,
+                                 triggers=args.records + len(DEFAULT.AS_TRIGGERS),
+                                 requests=stub.requests - requests))
+
+    return results
+
+
+def provisioning(args, stub):
+    from external_plugins.zendesk_plugin.mapping import provision_webhooks
+
+    instances_details = [
+        {"url": stub.url, "email": "admin{}@example.com".format(index), "password": "secret"}
+        for index in range(args.instances)
+    ]
+
+    started = time.perf_counter()
+    reports = provision_webhooks(instances_details, "AgilitySync", "https://example.com/hook")
+    elapsed = time.perf_counter() - started
+
+    return summarize("provisioning", [report["elapsed"] for report in reports], elapsed,
+                     instances=args.instances,
+                     failed=sum(1 for report in reports if report["status"] != "success"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default="decode,inbound,create,update,provisioning")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--writes", type=int, default=500)
+    parser.add_argument("--instances", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--tickets", type=int, default=1000)
+    parser.add_argument("--records", type=int, default=100000,
+                        help="tickets and triggers in the pagination scenario")
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="requests in flight in the async transport scenario")
+    parser.add_argument("--comments", type=int, default=4,
+                        help="comments copied by the attachments scenario")
+    parser.add_argument("--attachments", type=int, default=4,
+                        help="files per comment in the attachments scenario")
+    parser.add_argument("--attachment-size", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--profile", default=DEFAULT.WEBHOOK_PAYLOAD_PROFILE)
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="seconds added to every stub response")
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="answer every Nth request with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--batching", action="store_true",
+                        help="send outbound writes through create_many/update_many")
+    parser.add_argument("--client-rate-limit", action="store_true",
+                        help="keep the plugin rate limiter at its configured rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if not args.client_rate_limit:
+        # Measure the plugin, not the client side throttle.
+        DEFAULT.RATE_LIMIT_PER_MINUTE = 10 ** 9
+        DEFAULT.RATE_LIMIT_BURST = 10 ** 6
+    DEFAULT.OUTBOUND_BATCHING_ENABLED = args.batching
+    metrics.enable()
+
+    scenarios = args.scenarios.split(",")
+    started = time.time()
+    results = []
+
+    with StubZendesk(latency=args.latency, rate_limit_every=args.rate_limit_every,
+                     retry_after=args.retry_after, tickets=args.tickets) as stub:
+        if "decode" in scenarios:
+            results.append(inbound_decode(args))
+        if "inbound" in scenarios:
+            results.append(inbound_classification(args))
+        if "create" in scenarios:
+            results.append(outbound_writes(args, stub, "create"))
+        if "update" in scenarios:
+            results.append(outbound_writes(args, stub, "update"))
+        if "bulk_create" in scenarios:
+            results.append(outbound_bulk_writes(args, stub, "create"))
+        if "bulk_update" in scenarios:
+            results.append(outbound_bulk_writes(args, stub, "update"))
+        if "provisioning" in scenarios:
+            results.append(provisioning(args, stub))
+        if "pagination" in scenarios:
+            results.extend(pagination(args))
+        if "pool" in scenarios:
+            results.extend(connection_pool(args, stub))
+        if "transport" in scenarios:
+            results.extend(transport_reads(args, stub))
+        if "attachments" in scenarios:
+            results.append(attachment_transfer(args, stub))
+
+        report = {
+            "python": platform.python_version(),
+            "started": started,
+            "arguments": vars(args),
+            "stub": {"requests": stub.requests, "rate_limited": stub.rate_limited,
+                     "connections": stub.connections},
+            "results": results,
+            "metrics": metrics.snapshot()
+        }
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+
+API_PREFIX = "/{}/{}/".format(DEFAULT.INITIAL_PATH, DEFAULT.REST_ENDPOINT_VERSION)
+
+RESOURCES = {
+    "tickets": "ticket",
+    "ticket_fields": "ticket_field",
+    "webhooks": "webhook",
+    "trigger_categories": "trigger_category",
+    "triggers": "trigger"
+}
+
+RESOURCE_RE = re.compile(r"^([a-z_]+)(?:/(\d+))?$")
+FILE_RE = re.compile(r"^files/(\d+)$")
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections from concurrent writers.
+    request_queue_size = 128
+
+
+class Store(object):
+    """Records of one Zendesk account. Every Authorization header gets its
+    own store, so each benchmark instance starts empty.
+    """
+
+    def __init__(self, tickets=0):
+        self.ids = itertools.count(1)
+        self.records = {plural: {} for plural in RESOURCES}
+        self.jobs = {}
+        for _ in range(tickets):
+            self.insert("tickets", {"type": "task", "subject": "Seeded ticket"})
+
+    def insert(self, plural, record):
+        record = dict(record, id=next(self.ids))
+        if plural == "tickets":
+            record.setdefault("external_id", None)
+            record.setdefault("created_at", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+            record.setdefault("updated_at", record["created_at"])
+            record.setdefault("url", "{}tickets/{}.json".format(API_PREFIX, record["id"]))
+        self.records[plural][record["id"]] = record
+        return record
+
+
+class StubZendesk(object):
+    """Local Zendesk REST stand-in for benchmarks.
+
+    ``latency`` seconds are added to every response and every
+    ``rate_limit_every``-th request is answered with 429 and Retry-After.
+    List endpoints use cursor pagination, show_many, create_many and
+    update_many are supported and jobs complete immediately.
+
+    ``files/<bytes>?seed=<n>`` serves a file of that size, with content
+    that differs per seed, for attachment downloads and ``uploads`` discards what it receives; both stream in
+    FILE_CHUNK_SIZE pieces so large files never sit in the stub's memory.
+    """
+
+    def __init__(self, latency=0.0, rate_limit_every=0, retry_after=1, tickets=0,
+                 host="127.0.0.1", port=0):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.tickets = tickets
+        self.requests = 0
+        self.rate_limited = 0
+        self.uploaded_bytes = 0
+        self.connections = 0
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._server = Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def store(self, authorization):
+        with self._lock:
+            store = self._stores.get(authorization)
+            if store is None:
+                store = self._stores[authorization] = Store(self.tickets)
+            return store
+
+    def throttled(self):
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+                self.rate_limited += 1
+                return True
+        return False
+
+    def handle(self, method, path, query, body, store):
+        """Returns (status, response body)."""
+        if path == "organizations":
+            return 200, {"organizations": []}
+        if path == "search":
+            return 200, {"results": [{"id": 1, "type": "user"}], "count": 1}
+        if path == "tickets/show_many":
+            ids = [int(id) for id in query.get("ids", [""])[0].split(",") if id]
+            tickets = [store.records["tickets"][id] for id in ids if id in store.records["tickets"]]
+            return 200, {"tickets": tickets}
+        if path in ("tickets/create_many", "tickets/update_many"):
+            return 200, {"job_status": self.run_job(path, body["tickets"], store)}
+        if path.startswith("job_statuses/"):
+            return 200, {"job_status": store.jobs[path.split("/")[1]]}
+
+        match = RESOURCE_RE.match(path)
+        if match is None or match.group(1) not in RESOURCES:
+            return 404, {"error": "RecordNotFound"}
+
+        plural, id = match.group(1), match.group(2)
+        singular = RESOURCES[plural]
+        records = store.records[plural]
+
+        if method == "GET" and id is None:
+            return 200, self.page(plural, records, query)
+        if id is not None and int(id) not in records:
+            return 404, {"error": "RecordNotFound"}
+        if method == "GET":
+            return 200, {singular: records[int(id)]}
+        if method == "POST":
+            return 201, {singular: store.insert(plural, body[singular])}
+        if method == "PUT":
+            records[int(id)].update(body[singular])
+            return 200, {singular: records[int(id)]}
+        return 405, {"error": "MethodNotAllowed"}
+
+    def page(self, plural, records, query):
+        size = int(query.get("page[size]", [DEFAULT.PAGE_SIZE])[0])
+        start = int(query.get("page[after]", ["0"])[0])
+        has_more = start + size < len(records)
+        next_url = "{}{}{}?page[size]={}&page[after]={}".format(
+            self.url, API_PREFIX, plural, size, start + size)
+        # Sliced without copying the whole collection, which may be large.
+        return {
+            plural: list(itertools.islice(records.values(), start, start + size)),
+            "meta": {"has_more": has_more},
+            "links": {"next": next_url if has_more else None}
+        }
+
+    def run_job(self, path, tickets, store):
+        results = []
+        for index, ticket in enumerate(tickets):
+            if path.endswith("create_many"):
+                record = store.insert("tickets", ticket)
+                results.append({"index": index, "id": record["id"]})
+                continue
+
+            record = store.records["tickets"].setdefault(int(ticket["id"]), {"id": int(ticket["id"])})
+            record.update(ticket)
+            # Like Zendesk, update_many results carry no index.
+            results.append({"id": record["id"], "action": "update", "success": True,
+                            "status": "Updated"})
+
+        job = {"id": str(next(store.ids)), "status": "completed", "results": results}
+        store.jobs[job["id"]] = job
+        return job
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes; with Nagle on, kept-alive
+            # clients wait out the delayed ACK on every response.
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                # One handler per accepted TCP connection.
+                BaseHTTPRequestHandler.setup(self)
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                self.respond("GET")
+
+            def do_POST(self):
+                self.respond("POST")
+
+            def do_PUT(self):
+                self.respond("PUT")
+
+            def respond(self, method):
+                parts = urlsplit(self.path)
+                path = parts.path[len(API_PREFIX):] if parts.path.startswith(API_PREFIX) else parts.path
+                path = path.strip("/")
+
+                if method == "POST" and path == "uploads":
+                    body = None
+                    received = self.discard_body()
+                else:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    body = json.loads(self.rfile.read(length)) if length else None
+
+                # Files stand in for the source system, not Zendesk, so
+                # they are neither delayed nor rate limited.
+                match = FILE_RE.match(path)
+                if method == "GET" and match:
+                    self.send_file(int(match.group(1)), parse_qs(parts.query).get("seed", ["0"])[0])
+                    return
+
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if stub.throttled():
+                    self.send(429, {"error": "TooManyRequests"},
+                              {"Retry-After": str(stub.retry_after)})
+                    return
+
+                if body is None and path == "uploads":
+                    with stub._lock:
+                        stub.uploaded_bytes += received
+                    self.send(201, {"upload": {"token": "upload{}".format(stub.requests),
+                                               "size": received}})
+                    return
+
+                store = stub.store(self.headers.get("Authorization"))
+                status, response = stub.handle(method, path,
+                                               parse_qs(parts.query), body, store)
+                self.send(status, response)
+
+            def discard_body(self):
+                received = 0
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0], 16)
+                        if not size:
+                            self.rfile.readline()
+                            return received
+                        while size:
+                            chunk = self.rfile.read(min(size, FILE_CHUNK_SIZE))
+                            size -= len(chunk)
+                            received += len(chunk)
+                        self.rfile.readline()
+
+                remaining = int(self.headers.get("Content-Length") or 0)
+                while remaining:
+                    chunk = self.rfile.read(min(remaining, FILE_CHUNK_SIZE))
+                    remaining -= len(chunk)
+                    received += len(chunk)
+                return received
+
+            def send_file(self, size, seed):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                pattern = "{}-".format(seed).encode("utf-8")
+                chunk = (pattern * (FILE_CHUNK_SIZE // len(pattern) + 1))[:FILE_CHUNK_SIZE]
+                while size:
+                    self.wfile.write(chunk[:min(size, FILE_CHUNK_SIZE)])
+                    size -= min(size, FILE_CHUNK_SIZE)
+
+            def send(self, status, response, headers=None):
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+from external_plugins.zendesk_plugin import decode
+from external_plugins.zendesk_plugin import sync
+from external_plugins.zendesk_plugin.worker_pool import ticket_key
+import external_plugins.zendesk_plugin.default as DEFAULT
+
+
+class EventCoalescer(object):
+    """Optional stage in front of Event/Inbound processing. Webhook events
+    for the same ticket (host and id, see worker_pool.ticket_key) that
+    arrive within ``window`` seconds are collapsed into the one with the
+    latest revision, carrying the union of their event categories under
+    "coalesced_categories". Echoes of the integration user's own writes are
+    dropped on arrival.
+    """
+
+    def __init__(self, window=None):
+        self.window = DEFAULT.COALESCE_WINDOW if window is None else window
+        self.received = 0
+        self.collapsed = 0
+        self.echoes = 0
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        record = decode.record(event)
+        if sync.is_sync_user_event(record):
+            with self._lock:
+                self.received += 1
+                self.echoes += 1
+            return
+
+        key = ticket_key(event)
+        categories = sync.event_categories(event)
+
+        with self._lock:
+            self.received += 1
+            pending = self._pending.get(key)
+
+            if pending is None:
+                self._pending[key] = [event, categories, time.monotonic(), record.timestamp]
+                return
+
+            self.collapsed += 1
+            for category in categories:
+                if category not in pending[1]:
+                    pending[1].append(category)
+            if record.timestamp >= pending[3]:
+                pending[0] = event
+                pending[3] = record.timestamp
+
+    def drain(self, force=False):
+        """Return the coalesced events whose window has elapsed, oldest first.
+        With ``force`` every held event is returned, e.g. on shutdown.
+        """
+        now = time.monotonic()
+        ready = []
+
+        with self._lock:
+            while self._pending:
+                key, (event, categories, first_seen, _) = next(iter(self._pending.items()))
+                if not force and now - first_seen < self.window:
+                    break
+                del self._pending[key]
+                ready.append(dict(event, coalesced_categories=categories))
+
+        return ready
+
+    def stats(self):
+        with self._lock:
+            return {
+                "received": self.received,
+                "collapsed": self.collapsed,
+                "echoes": self.echoes,
+                "pending": len(self._pending)
+            }
@@ -0,0 +1,72 @@
+import threading
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin import transformer_functions
+from external_plugins.zendesk_plugin.cache import TTLCache
+
+# Newest comment id synced per (host, ticket id).
+_high_water = TTLCache(DEFAULT.COMMENT_HIGH_WATER_TTL,
+                       DEFAULT.COMMENT_HIGH_WATER_SIZE)
+
+# (revision, newest comment id) last handed out per (host, ticket id). The
+# id only becomes the high-water mark once an event with another revision
+# reads the ticket, i.e. once the framework is done with the event that
+# read it. A retried event reads the same comments again.
+_pending = TTLCache(DEFAULT.COMMENT_HIGH_WATER_TTL,
+                    DEFAULT.COMMENT_HIGH_WATER_SIZE)
+_high_water_lock = threading.Lock()
+
+
+def high_water(host, ticket_id):
+    return _high_water.get((host, str(ticket_id)))
+
+
+def mark(host, ticket_id, comment_id):
+    key = (host, str(ticket_id))
+    with _high_water_lock:
+        _mark(key, comment_id)
+
+
+def _mark(key, comment_id):
+    # Caller holds _high_water_lock.
+    current = _high_water.get(key)
+    if current is None or comment_id > current:
+        _high_water.set(key, comment_id)
+
+
+def new_comments(instance, host, ticket_id, revision):
+    """Comments added to a ticket since the last synced event, oldest first.
+    ``revision`` identifies the event reading them (its
+    updated_at_with_timestamp).
+
+    Comments are read newest first and reading stops at the high-water id,
+    so a burst of comments costs one page. The first call for a ticket only
+    returns its newest comment.
+    """
+    key = (host, str(ticket_id))
+    with _high_water_lock:
+        pending = _pending.get(key)
+        if pending is not None and pending[0] != revision:
+            _mark(key, pending[1])
+            _pending.invalidate(key)
+        last_id = _high_water.get(key)
+
+    comments = transformer_functions.paginate(
+        instance,
+        "tickets/{}/comments?sort_order=desc".format(ticket_id),
+        "comments",
+        page_size=1 if last_id is None else DEFAULT.COMMENT_PAGE_SIZE)
+
+    batch = []
+    for comment in comments:
+        if last_id is not None and comment["id"] <= last_id:
+            break
+        batch.append(comment)
+        if last_id is None:
+            break
+
+    if batch:
+        with _high_water_lock:
+            _pending.set(key, (revision, batch[0]["id"]))
+    batch.reverse()
+    return batch
@@ -0,0 +1,87 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional, faster JSON backend.
+    orjson = None
+
+from agilitysync.sync import as_exceptions
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin import transformer_functions
+from external_plugins.zendesk_plugin.timestamps import parse_timestamp
+
+REQUIRED_PATHS = [tuple(path.split(".")) for path in DEFAULT.WEBHOOK_REQUIRED_FIELDS]
+DROPPED_PATHS = [tuple(path.split(".")) for path in DEFAULT.WEBHOOK_DROPPED_FIELDS]
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+class EventRecord(object):
+    """Values of a webhook event that every sync stage reads, computed once
+    when the event is decoded.
+    """
+    __slots__ = ("action", "asset", "workitem_id", "url", "host", "user_id",
+                 "revision", "timestamp")
+
+    def __init__(self, event):
+        ticket = event['ticket']
+
+        self.action = event['action']
+        self.asset = ticket['type'].lower()
+        self.workitem_id = ticket['id']
+        self.url = ticket['url'].partition("/")[2]
+        # Normalized like the hosts register_sync_user stores.
+        self.host = transformer_functions.instance_host(ticket['url'])
+        self.user_id = event['user']['id']
+        self.revision = ticket['updated_at_with_timestamp']
+        self.timestamp = parse_timestamp(self.revision)
+
+
+def validate(event):
+    for path in REQUIRED_PATHS:
+        value = event
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                raise as_exceptions.PayloadError(
+                    'Invalid webhook payload. Missing [{}].'.format(".".join(path)))
+            value = value[key]
+        if value is None:
+            raise as_exceptions.PayloadError(
+                'Invalid webhook payload. Empty [{}].'.format(".".join(path)))
+
+
+def strip(event):
+    for path in DROPPED_PATHS:
+        parent = event
+        for key in path[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if isinstance(parent, dict):
+            parent.pop(path[-1], None)
+
+
+def record(event):
+    """Validate ``event`` and build its EventRecord. Callers that read the
+    record more than once keep it themselves (see sync.Event.record); the
+    framework owned event dict is never modified.
+    """
+    validate(event)
+    return EventRecord(event)
+
+
+def decode(body):
+    """Parse a webhook body once, validate it and drop the blobs the plugin
+    never reads.
+    """
+    try:
+        event = loads(body)
+    except ValueError as e:
+        raise as_exceptions.PayloadError('Invalid webhook payload. Error is [{}].'.format(str(e)))
+
+    if not isinstance(event, dict):
+        raise as_exceptions.PayloadError('Invalid webhook payload. Expected a JSON object.')
+
+    # The parsed dict is ours until it is returned.
+    strip(event)
+    validate(event)
+    return event
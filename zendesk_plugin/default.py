@@ -1,5 +1,12 @@
+import os
+
 REST_ENDPOINT_VERSION = "v2"
 
+# Directory for state the plugin keeps across restarts.
+STATE_DIR = os.environ.get(
+    "AS_ZENDESK_STATE_DIR",
+    os.path.join(os.path.expanduser("~"), ".agilitysync", "zendesk_plugin"))
+
 INITIAL_PATH = "api"
 
 TRIGGER_CATEGORY_NAME = "All AS Triggers"
@@ -16,3 +23,284 @@ AS_TRIGGERS = [
         "conditions_value": "Change"
     }
 ]
+
+# Maximum number of keep-alive REST clients shared across Inbound, Outbound
+# and AssetsManage. Set to 0 to create a new client on every connect().
+CONNECTION_POOL_SIZE = 32
+
+# Seconds a pooled REST client may stay unused before it is discarded.
+CONNECTION_IDLE_TIMEOUT = 300
+
+# Opt-in batching of outbound ticket writes through tickets/create_many and
+# tickets/update_many. Single writes are held for at most OUTBOUND_BATCH_WINDOW
+# seconds or until OUTBOUND_BATCH_SIZE writes are pending (Zendesk allows 100);
+# batching.write_many sends its writes without waiting.
+#
+# Outbound.create, update and comment_create each write one ticket and block
+# until its job has finished. With batching enabled every one of them waits
+# at least OUTBOUND_BATCH_WINDOW plus one JOB_STATUS_POLL_INTERVAL, so a single
+# caller drops from hundreds of writes per second to a few dozen; it only
+# pays off with many concurrent callers. No Outbound entry point calls
+# batching.write_many: bulk tools that hold many writes must call it directly.
+OUTBOUND_BATCHING_ENABLED = False
+OUTBOUND_BATCH_SIZE = 100
+OUTBOUND_BATCH_WINDOW = 0.5
+
+# Polling of the job_statuses endpoint for batched writes.
+JOB_STATUS_POLL_INTERVAL = 1
+JOB_STATUS_TIMEOUT = 300
+
+# Seconds ticket field metadata is reused by Fields, AssetsManage and
+# is_instance_supported before it is fetched again.
+METADATA_CACHE_TTL = 300
+METADATA_CACHE_SIZE = 256
+
+# Records requested per page when following cursor pagination (Zendesk max 100).
+PAGE_SIZE = 100
+
+# Client side request budget per instance. The bucket is re-seeded from
+# X-Rate-Limit headers whenever Zendesk returns them.
+RATE_LIMIT_PER_MINUTE = 700
+RATE_LIMIT_BURST = 50
+
+# Fraction of the bucket that bulk outbound writes leave for interactive calls.
+RATE_LIMIT_INTERACTIVE_RESERVE = 0.2
+
+# Retries of a 429 response. Without Retry-After the delay is a random value
+# up to RATE_LIMIT_BASE_BACKOFF * 2 ** attempt, capped at RATE_LIMIT_MAX_BACKOFF.
+RATE_LIMIT_MAX_RETRIES = 5
+RATE_LIMIT_BASE_BACKOFF = 1
+RATE_LIMIT_MAX_BACKOFF = 60
+
+# Body of the notification_webhook action installed on every AS trigger.
+# The "action" key is filled in per trigger from AS_TRIGGERS.
+WEBHOOK_PAYLOAD_TEMPLATE = {
+    "ticket": {
+        "id": "{{ticket.id}}",
+        "external_id": "{{ticket.external_id}}",
+        "title": "{{ticket.title}}",
+        "type": "{{ticket.ticket_type}}",
+        "status": "{{ticket.status}}",
+        "url": "{{ticket.url}}",
+        "description": "{{ticket.description}}",
+        "created_at_with_timestamp": "{{ticket.created_at_with_timestamp}}",
+        "created_at_with_time": "{{ticket.created_at_with_time}}",
+        "updated_at_with_time": "{{ticket.updated_at_with_time}}",
+        "updated_at_with_timestamp": "{{ticket.updated_at_with_timestamp}}",
+        "due_date": "{{ticket.due_date}}",
+        "priority": "{{ticket.priority}}",
+        "source": "{{ticket.via}}",
+        "account": "{{ticket.account}}",
+        "brand_name": "{{ticket.brand.name}}",
+        "cc_names": "{{ticket.cc_names}}",
+        "ccs": "{{ticket.ccs}}",
+        "current_holiday_name": "{{ticket.current_holiday_name}}",
+        "latest_comment_html": "{{ticket.latest_comment_html}}",
+        "latest_public_comment_html": "{{ticket.latest_public_comment_html}}",
+        "tags": "{{ticket.tags}}",
+        "ticket_field_ID": "{{ticket.ticket_field_ID}}",
+        "ticket_field_option_title_ID": "{{ticket.ticket_field_option_title_ID}}",
+        "via": "{{ticket.via}}",
+        "group": {
+            "name": "{{ticket.group.name}}"
+        },
+        "requester": {
+            "details": "{{ticket.requester.details}}",
+            "email": "{{ticket.requester.email}}",
+            "external_id": "{{ticket.requester.external_id}}",
+            "first_name": "{{ticket.requester.first_name}}",
+            "language": "{{ticket.requester.language}}",
+            "last_name": "{{ticket.requester.last_name}}",
+            "name": "{{ticket.requester.name}}",
+            "phone": "{{ticket.requester.phone}}",
+            "requester_field": "{{ticket.requester_field}}"
+        },
+        "assignee": {
+            "email": "{{ticket.assignee.email}}",
+            "name": "{{ticket.assignee.name}}",
+            "first_name": "{{ticket.assignee.first_name}}",
+            "last_name": "{{ticket.assignee.last_name}}"
+        },
+        "organization": {
+            "name": "{{ticket.organization.name}}",
+            "external_id": "{{ticket.organization.external_id}}",
+            "details": "{{ticket.organization.details}}",
+            "notes": "{{ticket.organization.notes}}"
+        }
+    },
+    "user": {
+        "external_id": "{{current_user.external_id}}",
+        "id": "{{current_user.id}}",
+        "name": "{{current_user.name}}",
+        "first_name": "{{current_user.first_name}}",
+        "last_name": "{{current_user.last_name}}",
+        "email": "{{current_user.email}}",
+        "details": "{{current_user.details}}",
+        "notes": "{{current_user.notes}}",
+        "phone": "{{current_user.phone}}",
+        "language": "{{current_user.language}}",
+        "organization": {
+            "name": "{{current_user.organization.name}}",
+            "details": "{{current_user.organization.details}}",
+            "notes": "{{current_user.organization.notes}}"
+        }
+    }
+}
+
+# Instances provisioned concurrently by mapping.provision_webhooks.
+PROVISIONING_WORKERS = 8
+
+# Leading characters of latest_public_comment_html searched for the comment
+# header that carries the update time.
+COMMENT_HEADER_SCAN_LENGTH = 2048
+
+# Seconds coalesce.EventCoalescer holds webhook events for one ticket.
+COALESCE_WINDOW = 2
+
+# Opt-in: Outbound.update sends only fields whose value differs from the last
+# value synced to the ticket. Digests expire after SYNCED_FIELDS_TTL seconds
+# and are dropped whenever a non-cyclic webhook arrives for the ticket.
+# The digests live in process memory and only the process that receives a
+# ticket's webhooks drops them, so enable this only when one process both
+# receives the webhooks and writes to Zendesk. With several processes (e.g.
+# the inbound worker pool), a field edited in Zendesk and then set back by
+# the source is dropped as unchanged for up to SYNCED_FIELDS_TTL.
+OUTBOUND_DELTA_ENABLED = False
+SYNCED_FIELDS_TTL = 3600
+SYNCED_FIELDS_SIZE = 100000
+
+# Concurrent connections per instance for the aiohttp based async transport.
+# With ASYNC_TRANSPORT_ENABLED, Inbound, Outbound and AssetsManage talk to
+# Zendesk through it with a blocking adapter.
+ASYNC_CONNECTION_LIMIT = 100
+ASYNC_TRANSPORT_ENABLED = False
+
+# Seconds the integration user's id, looked up through the search API,
+# is reused before searching again.
+USER_CACHE_TTL = 86400
+USER_CACHE_SIZE = 1024
+
+# Attachment transfer. Files are streamed in ATTACHMENT_CHUNK_SIZE pieces and
+# spooled to disk beyond ATTACHMENT_SPOOL_MEMORY bytes; up to
+# ATTACHMENT_WORKERS files of one comment are transferred in parallel.
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+ATTACHMENT_SPOOL_MEMORY = 1024 * 1024
+ATTACHMENT_WORKERS = 4
+ATTACHMENT_TIMEOUT = 300
+ATTACHMENT_COMMENT_BODY = "Attachment(s) synced by AgilitySync."
+
+# How long content hashes of synced attachments are remembered per ticket.
+ATTACHMENT_DEDUPE_TTL = 86400
+ATTACHMENT_DEDUPE_SIZE = 10000
+
+# Incremental export catch-up. One cursor file per instance is kept in
+# CATCHUP_STATE_DIR; without a cursor the export starts
+# CATCHUP_INITIAL_WINDOW seconds in the past.
+CATCHUP_STATE_DIR = os.path.join(STATE_DIR, "catchup")
+CATCHUP_INITIAL_WINDOW = 86400
+
+# Record per-endpoint latency, bytes and error counters for every Zendesk
+# call and plugin entry point. Can also be switched at runtime with
+# metrics.enable().
+METRICS_ENABLED = False
+
+# The default REST client returns parsed JSON only, so its request and
+# response sizes can only be estimated by serializing them again. That costs
+# a json.dumps per call and is off unless enabled here; transports that see
+# the wire (uploads, the async client) always report measured sizes.
+METRICS_PAYLOAD_ESTIMATES = False
+
+# Durable write-ahead queue for outbound writes. Updates and comments are
+# journaled to SQLite and applied by OUTBOUND_QUEUE_WORKERS threads, one per
+# ticket shard. Creates are journaled and sent inline with an Idempotency-Key.
+# Writes journaled by a previous run are drained once Outbound connects to
+# their instance again.
+OUTBOUND_QUEUE_ENABLED = False
+OUTBOUND_QUEUE_PATH = os.path.join(STATE_DIR, "outbound_queue.sqlite3")
+OUTBOUND_QUEUE_WORKERS = 4
+OUTBOUND_QUEUE_POLL_INTERVAL = 1
+OUTBOUND_QUEUE_MAX_ATTEMPTS = 10
+
+# Attempts of a create with an unknown outcome before Outbound.create fails.
+OUTBOUND_CREATE_ATTEMPTS = 3
+
+# Zendesk honours a create Idempotency-Key for two hours.
+OUTBOUND_IDEMPOTENCY_WINDOW = 7200
+
+# Seconds applied writes stay in the journal before they are purged.
+OUTBOUND_QUEUE_RETENTION = 7200
+
+# Newest comments checked before a comment is sent again after a failed or
+# interrupted attempt.
+OUTBOUND_QUEUE_COMMENT_LOOKBACK = 10
+
+# Trigger payload profile: "full" sends WEBHOOK_PAYLOAD_TEMPLATE; "compact"
+# sends COMPACT_TICKET_FIELDS, the template key of every ticket field of the
+# instance and WEBHOOK_PAYLOAD_EXTRA_FIELDS (dotted keys of
+# WEBHOOK_PAYLOAD_TEMPLATE["ticket"]). The compact template is built when the
+# triggers are reconciled. Keys an event lacks are filled in from
+# tickets/show_many before its field values are read.
+WEBHOOK_PAYLOAD_PROFILE = "full"
+WEBHOOK_PAYLOAD_EXTRA_FIELDS = []
+
+COMPACT_TICKET_FIELDS = [
+    "id",
+    "type",
+    "status",
+    "url",
+    "updated_at_with_time",
+    "updated_at_with_timestamp",
+    "latest_public_comment_html"
+]
+
+COMPACT_USER_FIELDS = [
+    "id"
+]
+
+# tickets/show_many accepts at most SHOW_MANY_LIMIT ids per request; bulk
+# reads send up to BULK_READ_WORKERS of those requests in parallel.
+SHOW_MANY_LIMIT = 100
+BULK_READ_WORKERS = 4
+
+# On-demand ticket lookups are collected for at most TICKET_LOADER_WINDOW
+# seconds and sent as one tickets/show_many request (Zendesk allows 100 ids).
+TICKET_LOADER_WINDOW = 0.05
+TICKET_LOADER_BATCH_SIZE = SHOW_MANY_LIMIT
+TICKET_LOADER_SIDELOADS = ["users", "groups", "organizations", "brands"]
+
+# Newest comment id synced per ticket. Only newer comments are fetched from
+# tickets/{id}/comments; without a mark only the newest is returned. A mark
+# moves once the next event of the ticket reads its comments, so a retried
+# event gets the same comments again.
+COMMENT_HIGH_WATER_TTL = 86400
+COMMENT_HIGH_WATER_SIZE = 100000
+COMMENT_PAGE_SIZE = 20
+
+# Joins the comments Inbound.fetch_comment returns for one event.
+COMMENT_BATCH_SEPARATOR = "\n\n"
+
+# Ticket-sharded inbound worker processes. Each shard has a bounded queue;
+# submit() blocks once INBOUND_WORKER_QUEUE_SIZE events are waiting.
+INBOUND_WORKER_PROCESSES = os.cpu_count() or 1
+INBOUND_WORKER_QUEUE_SIZE = 1000
+# Handler failures kept for ShardedInboundPool.failures(); every failure is
+# logged by its worker as well.
+INBOUND_WORKER_FAILURES_SIZE = 1000
+INBOUND_REVISION_TTL = 86400
+INBOUND_REVISION_SIZE = 100000
+
+# Webhook payload fields that must be present, and large blobs the plugin
+# never reads that are removed as soon as an event is decoded.
+WEBHOOK_REQUIRED_FIELDS = [
+    "action",
+    "ticket.id",
+    "ticket.type",
+    "ticket.url",
+    "ticket.updated_at_with_timestamp",
+    "user.id"
+]
+WEBHOOK_DROPPED_FIELDS = [
+    "ticket.organization.notes",
+    "ticket.organization.details",
+    "ticket.requester.details"
+]
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+
+
+class SyncedFieldStore(object):
+    """Digest of the last value synced for each field of a ticket, used by
+    Outbound.update to send only the fields that changed.
+
+    Entries are keyed by ticket id and then by instance url so that an
+    inbound change to a ticket can drop its digests without knowing which
+    instance it came from.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def changed_fields(self, instance_url, ticket_id, fields):
+        synced = self._synced(instance_url, str(ticket_id))
+        return {
+            name: value for name, value in fields.items()
+            if synced.get(name) != field_digest(value)
+        }
+
+    def record(self, instance_url, ticket_id, fields):
+        digests = {name: field_digest(value) for name, value in fields.items()}
+        expires = time.monotonic() + self.ttl
+
+        with self._lock:
+            instances = self._tickets.setdefault(str(ticket_id), {})
+            synced, _ = instances.get(instance_url, ({}, None))
+            synced.update(digests)
+            instances[instance_url] = (synced, expires)
+            self._tickets.move_to_end(str(ticket_id))
+
+            while len(self._tickets) > self.max_size:
+                self._tickets.popitem(last=False)
+
+    def forget(self, ticket_id):
+        with self._lock:
+            self._tickets.pop(str(ticket_id), None)
+
+    def _synced(self, instance_url, ticket_id):
+        with self._lock:
+            synced, expires = self._tickets.get(ticket_id, {}).get(instance_url, ({}, 0))
+            return dict(synced) if expires > time.monotonic() else {}
+
+
+def field_digest(value):
+    data = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+synced_fields = SyncedFieldStore(DEFAULT.SYNCED_FIELDS_TTL,
+                                 DEFAULT.SYNCED_FIELDS_SIZE)
@@ -0,0 +1,147 @@
+import threading
+
+from agilitysync.mapping import FieldTypes, FieldDisplayIcon
+
+from external_plugins.zendesk_plugin import transformer_functions
+
+TEXT_TYPES = frozenset([
+    "text", "subject", "regexp", "partialcreditcard", "date", "lookup",
+    "assignee", "group", "custom_status"
+])
+HTML_TYPES = frozenset(["textarea", "description"])
+NUMERIC_TYPES = frozenset(["integer", "decimal"])
+OPTION_TYPES = frozenset(["tagger", "multiselect", "status", "tickettype", "priority"])
+MULTIVALUE_TYPES = frozenset(["multiselect"])
+
+# Webhook template key (a dotted path into the "ticket" object) of every
+# system field type. Custom fields use "ticket_field_<id>".
+SYSTEM_TEMPLATE_KEYS = {
+    "subject": "title",
+    "description": "description",
+    "status": "status",
+    "tickettype": "type",
+    "priority": "priority",
+    "group": "group.name",
+    "assignee": "assignee.name"
+}
+
+CHECKBOX_OPTIONS = [
+    {"name": "Yes", "value": True},
+    {"name": "No", "value": False}
+]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def field_options(field):
+    if field["type"] == "checkbox":
+        return CHECKBOX_OPTIONS
+    return field.get("custom_field_options") or field.get("system_field_options") or []
+
+
+def type_info(field):
+    """Field type info for a ticket field as returned by ticket_fields,
+    covering both system and custom field types.
+    """
+    field_type = field["type"]
+    options = field_options(field)
+
+    if field_type in OPTION_TYPES or field_type == "checkbox" or options:
+        return {
+            "type": FieldTypes.LIST,
+            "display_icon": FieldDisplayIcon.DROPDOWN,
+            "values": [
+                {
+                    "id": "{}".format(option["value"]),
+                    "value": option["value"],
+                    "display_value": option["name"]
+                }
+                for option in options
+            ],
+            "value_type": FieldDisplayIcon.TEXT
+        }
+    elif field_type in NUMERIC_TYPES:
+        return {"type": FieldTypes.NUMERIC, "display_icon": FieldDisplayIcon.NUMERIC}
+    elif field_type in HTML_TYPES:
+        return {"type": FieldTypes.HTML, "display_icon": FieldDisplayIcon.HTML}
+
+    # Dates, lookups and unknown future types are synced as plain text.
+    return {"type": FieldTypes.TEXT, "display_icon": FieldDisplayIcon.TEXT}
+
+
+def is_multivalue(field):
+    return field["type"] in MULTIVALUE_TYPES
+
+
+def template_key(field):
+    """Key of ``field`` in the webhook "ticket" object, or None for system
+    fields the trigger payload does not carry.
+    """
+    if field.get("removable") is False:
+        return SYSTEM_TEMPLATE_KEYS.get(field["type"])
+    return "ticket_field_{}".format(field["id"])
+
+
+class OptionIndex(object):
+    """Option name to option value for every list field of one instance,
+    keyed by the lower cased raw_title used as the outbound field name.
+
+    refresh() only rebuilds fields whose updated_at changed, and does
+    nothing while the cached ticket_fields list is unchanged.
+    """
+
+    def __init__(self):
+        self._fields = {}
+        self._options = {}
+        self._source = None
+        self._lock = threading.Lock()
+
+    def refresh(self, fields):
+        with self._lock:
+            if fields is self._source:
+                return
+            seen = set()
+
+            for field in fields:
+                field_id = field["id"]
+                seen.add(field_id)
+                known = self._fields.get(field_id)
+                if known is not None and known[0] == field.get("updated_at"):
+                    continue
+
+                if known is not None:
+                    self._options.pop(known[1], None)
+                name = field["raw_title"].lower()
+                self._fields[field_id] = (field.get("updated_at"), name)
+
+                options = field_options(field)
+                if options:
+                    self._options[name] = {option["name"]: option["value"] for option in options}
+
+            for field_id in [field_id for field_id in self._fields if field_id not in seen]:
+                self._options.pop(self._fields.pop(field_id)[1], None)
+            self._source = fields
+
+    def translate(self, name, value):
+        """Option value for ``value`` on field ``name``. Values that are not
+        option names, including option values themselves, pass through.
+        """
+        options = self._options.get(name)
+        if options is None or value is None:
+            return value
+        if isinstance(value, (list, tuple)):
+            return [options.get(item, item) for item in value]
+        return options.get(value, value)
+
+
+def option_index(instance):
+    key = transformer_functions.instance_key(instance)
+
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = OptionIndex()
+
+    index.refresh(transformer_functions.cached_ticket_fields(instance))
+    return index
@@ -1,18 +1,64 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from agilitysync.mapping import (
     BaseField,
     BaseAssetsManage,
-    BaseAutoMap,
     BaseWebHook,
     as_exceptions,
-    BaseFields,
-    FieldTypes,
-    FieldDisplayIcon
+    BaseFields
 )
 
+from external_plugins.zendesk_plugin import async_transformer_functions
+from external_plugins.zendesk_plugin import field_schema
 from external_plugins.zendesk_plugin import transformer_functions
 import external_plugins.zendesk_plugin.default as DEFAULT
 
-from agilitysync.external_lib.restapi import ASyncRestApi
+
+def template_value(template, key):
+    """Liquid placeholder of the dotted ``key`` in ``template``, or the
+    {{ticket.<key>}} placeholder for keys it does not list (custom fields).
+    """
+    value = template
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return "{{{{ticket.{}}}}}".format(key)
+        value = value[part]
+    return value
+
+
+def webhook_payload_template(profile, ticket_fields=()):
+    """Trigger payload body for ``profile``. The compact body is rebuilt
+    from the current configuration and the template key of every field in
+    ``ticket_fields``, so the values the mapping reads are always sent.
+    """
+    if profile == "full":
+        return DEFAULT.WEBHOOK_PAYLOAD_TEMPLATE
+
+    keys = list(DEFAULT.COMPACT_TICKET_FIELDS)
+    keys.extend(key for key in (field_schema.template_key(field) for field in ticket_fields) if key)
+    keys.extend(DEFAULT.WEBHOOK_PAYLOAD_EXTRA_FIELDS)
+
+    ticket = {}
+    for key in keys:
+        parent = ticket
+        parts = key.split(".")
+        for part in parts[:-1]:
+            parent = parent.setdefault(part, {})
+        parent[parts[-1]] = template_value(DEFAULT.WEBHOOK_PAYLOAD_TEMPLATE["ticket"], key)
+
+    return {
+        "ticket": ticket,
+        "user": {key: DEFAULT.WEBHOOK_PAYLOAD_TEMPLATE["user"][key] for key in DEFAULT.COMPACT_USER_FIELDS}
+    }
+
+
+def trigger_payload(webhook_type, ticket_fields=(), profile=None):
+    """Serialized notification_webhook body of the AS trigger for ``webhook_type``."""
+    template = webhook_payload_template(profile or DEFAULT.WEBHOOK_PAYLOAD_PROFILE, ticket_fields)
+    return json.dumps(dict([("action", webhook_type)], **template), indent=4)
+
 
 class Field(BaseField):
     def is_required_field(self):
@@ -36,100 +82,32 @@ class Field(BaseField):
         return self.field_attr["title"]
 
     def is_multivalue_field(self):
-        return False  # self.field_attr["IsMultivalue"]
+        return field_schema.is_multivalue(self.field_attr)
 
     def fetch_fieldtype_info(self):
-        fields_type = {
-            "TEXT": "text",
-            "TEXTAREA": "textarea",
-            "CHECKBOX": "checkbox",
-            "DATE": "date",
-            "INTEGER": "integer",
-            "DECIMAL": "decimal",
-            "REGEXP": "regexp",
-            "PARTIALCREDITCARD": "partialcreditcard",
-            "MULTISELECT": "multiselect",
-            "TAGGER": "tagger",
-            "LOOKUP": "lookup"
-        }
-
-        fields = {
-            "subject": {
-                "type": fields_type["TEXT"],
-                "system": "subject"
-            },
-            "description": {
-                "type": fields_type["TEXT"],
-                "system": "description"
-            },
-            "status": {
-                "type": fields_type["TEXT"],
-                "system": "status"
-            },
-            "tickettype": {
-                "type": fields_type["TEXT"],
-                "system": "tickettype"
-            },
-            "priority": {
-                "type": fields_type["TEXT"],
-                "system": "priority"
-            },
-            "group": {
-                "type": fields_type["TEXT"],
-                "system": "group"
-            },
-            "assignee": {
-                "type": fields_type["TEXT"],
-                "system": "assignee"
-            },
-            "tagger": {
-                "type": fields_type["TEXT"],
-                "system": "tagger"
-            },
-            "custom_status": {
-                "type": fields_type["TEXT"],
-                "system": "custom_status"
-            }
-        }
-        attribute_type = fields[self.field_attr['type']]["type"].capitalize()
-
-        if attribute_type == 'Text':
-            return {"type": FieldTypes.TEXT, "display_icon": FieldDisplayIcon.TEXT}
-        elif attribute_type == 'LongText':
-            return {"type": FieldTypes.HTML, "display_icon": FieldDisplayIcon.HTML}
-        elif attribute_type == 'Numeric':
-            return {"type": FieldTypes.NUMERIC, "display_icon": FieldDisplayIcon.NUMERIC}
-        elif attribute_type == 'Relation':
-            return {
-                "type": FieldTypes.LIST,
-                "display_icon": FieldDisplayIcon.DROPDOWN,
-                "values": [
-                    {"id": "Status_123", "value": "Status_123", "display_value": "Open"},
-                    {"id": "Status_124", "value": "Status_124", "display_value": "In Progress"}
-                ],
-                "value_type": FieldDisplayIcon.TEXT
-            }
+        return field_schema.type_info(self.field_attr)
 
 
 class Fields(BaseFields):
 
     def fetch_fields(self):
-        fields = transformer_functions.ticket_fields(self.instance_obj)
+        fields = transformer_functions.cached_ticket_fields(self.instance_obj)
         return fields
 
 
 class AssetsManage(BaseAssetsManage):
 
     def connect(self):
-        return transformer_functions.connect(
+        return async_transformer_functions.transport_connect(
             self.instance_details
         )
 
     def fetch_sync_user(self):
-        user = transformer_functions.get_user_by_email(
+        user_id = transformer_functions.cached_user_id_by_email(
             self.instance_obj,
             self.instance_details['email'])
-        return user["results"][0]["id"]
+        transformer_functions.register_sync_user(self.instance_details['url'], user_id)
+        return user_id
 
     def fetch_projects(self):
         projects = [
@@ -143,7 +121,7 @@ class AssetsManage(BaseAssetsManage):
 
     def fetch_assets(self):
         asset_types = []
-        for field in transformer_functions.ticket_fields(self.instance_obj):
+        for field in transformer_functions.cached_ticket_fields(self.instance_obj):
             if field["type"] == "tickettype":
                 for option in field["system_field_options"]:
                     asset_types.append(
@@ -155,10 +133,10 @@ class AssetsManage(BaseAssetsManage):
         return asset_types
 
     def is_instance_supported(self):
-        tickets_data = transformer_functions.tickets(self.instance_obj)
+        ticket = transformer_functions.cached_first_ticket(self.instance_obj)
 
-        if tickets_data:
-            tik_url = tickets_data[0].get("url")
+        if ticket:
+            tik_url = ticket.get("url")
             if (DEFAULT.REST_ENDPOINT_VERSION in tik_url.split("/")):
                 return (True, None)
             else:
@@ -176,47 +154,12 @@ class AssetsManage(BaseAssetsManage):
 class WebHook(BaseWebHook):
 
     def create_webhook(self, webhook_name, webhook_url, webhook_description):
-        payload = {
-            "webhook": {
-                "endpoint": "{}".format(webhook_url),
-                "http_method": "POST",
-                "name": "{}".format(webhook_name),
-                "status": "active",
-                "request_format": "json",
-                "subscriptions": ["conditional_ticket_events"]
-            }
-        }  # Payload data to create single webhook
-
-        webhook_data = transformer_functions.webhooks(self.instance_obj,
-                                                      payload=payload)  # Creating webhook
-        category_id = self.create_trigger_categories()  # Creating trigger category
-        self.create_triggers(webhook_data["id"], category_id)  # Creating triggers
+        provision_webhook(self.instance_obj, webhook_name, webhook_url)
 
     def create_trigger_categories(self):
-        trigger_category_exist_list = transformer_functions.trigger_categories(self.instance_obj)
-
-        trigger_category_exist = [
-            {
-                "name": trigger_categories["name"],
-                "id": trigger_categories["id"]
-            } for trigger_categories in trigger_category_exist_list
-            if trigger_categories["name"] == DEFAULT.TRIGGER_CATEGORY_NAME
-        ]
-
-        if trigger_category_exist:
-            # Trigger category exist return exist category id.
-            trigger_categories_id = trigger_category_exist[0]["id"]
-            return trigger_categories_id
-        else:
-            # Trigger category does not exist creating it and return the new category id.
-            payload = {
-                "trigger_category": {
-                    "name": "{}".format(DEFAULT.TRIGGER_CATEGORY_NAME),
-                    "position": 0
-                }
-            }
-            catagory_data = transformer_functions.trigger_categories(self.instance_obj,payload=payload)
-            return catagory_data["id"]
+        return ensure_trigger_category(
+            self.instance_obj,
+            transformer_functions.iter_trigger_categories(self.instance_obj))
 
     def create_triggers(self, webhook_id, category_id):
         """Function to create AgilitySync Triggers.
@@ -224,46 +167,188 @@ class WebHook(BaseWebHook):
         self.create_ticket_trigger(webhook_id, category_id)
 
     def create_ticket_trigger(self, webhook_id, category_id):
-        triggers_list = transformer_functions.triggers(self.instance_obj)
-
-        for as_trigger in DEFAULT.AS_TRIGGERS:
-
-            exist_as_trigger = [trigger for trigger in triggers_list
-                    if trigger["raw_title"] == as_trigger["title"]]
-
-            if exist_as_trigger:
-                update_payload = {
-                    "trigger": {
-                        "title": "{}".format(as_trigger["title"]),
-                        "actions": [{
-                            "field": "notification_webhook",
-                            "value": ["{}".format(webhook_id), "{\n    \"action\": \"TICKET_ACTION_TYPE\",\n\t\"ticket\": {\n        \"id\": \"{{ticket.id}}\",\n\t\t\"external_id\": \"{{ticket.external_id}}\",\n\t\t\"title\": \"{{ticket.title}}\",\n\t\t\"type\": \"{{ticket.ticket_type}}\",\n\t\t\"status\": \"{{ticket.status}}\",\n\t\t\"url\": \"{{ticket.url}}\",\n        \"description\": \"{{ticket.description}}\",\n\t\t\"created_at_with_timestamp\": \"{{ticket.created_at_with_timestamp}}\",\n\t\t\"created_at_with_time\": \"{{ticket.created_at_with_time}}\",\n\t\t\"updated_at_with_time\": \"{{ticket.updated_at_with_time}}\",\n\t\t\"updated_at_with_timestamp\": \"{{ticket.updated_at_with_timestamp}}\",\n        \"due_date\": \"{{ticket.due_date}}\",\n        \"priority\": \"{{ticket.priority}}\",\n        \"source\": \"{{ticket.via}}\",\n\t\t\"account\": \"{{ticket.account}}\",\n\t\t\"brand_name\": \"{{ticket.brand.name}}\",\n\t\t\"cc_names\": \"{{ticket.cc_names}}\",\n\t\t\"ccs\": \"{{ticket.ccs}}\",\n\t\t\"current_holiday_name\": \"{{ticket.current_holiday_name}}\",\n\t\t\"latest_comment_html\": \"{{ticket.latest_comment_html}}\",\n\t\t\"latest_public_comment_html\": \"{{ticket.latest_public_comment_html}}\",\n\t\t\"tags\": \"{{ticket.tags}}\",\n\t\t\"ticket_field_ID\": \"{{ticket.ticket_field_ID}}\",\n\t\t\"ticket_field_option_title_ID\": \"{{ticket.ticket_field_option_title_ID}}\",\n\t\t\"via\": \"{{ticket.via}}\",\n\t\t\"group\":{\n\t\t\t\"name\": \"{{ticket.group.name}}\"\t\n\t\t},\n\t\t\"requester\": {\n\t\t\t\"details\": \"{{ticket.requester.details}}\",\n\t\t\t\"email\": \"{{ticket.requester.email}}\",\n\t\t\t\"external_id\": \"{{ticket.requester.external_id}}\",\n\t\t\t\"first_name\": \"{{ticket.requester.first_name}}\",\n\t\t\t\"language\": \"{{ticket.requester.language}}\",\n\t\t\t\"last_name\": \"{{ticket.requester.last_name}}\",\n\t\t\t\"name\": \"{{ticket.requester.name}}\",\n\t\t\t\"phone\": \"{{ticket.requester.phone}}\",\n\t\t\t\"requester_field\": \"{{ticket.requester_field}}\"\n\t\t},\n\t\t\"assignee\": {\n            \"email\": \"{{ticket.assignee.email}}\",\n            \"name\": \"{{ticket.assignee.name}}\",\n            \"first_name\": \"{{ticket.assignee.first_name}}\",\n            \"last_name\": \"{{ticket.assignee.last_name}}\"\n    \t},\n\t\t\"organization\": {\n        \t\"name\": \"{{ticket.organization.name}}\",\n\t\t\t\"external_id\": \"{{ticket.organization.external_id}}\",\n\t\t\t\"details\": \"{{ticket.organization.details}}\",\n\t\t\t\"notes\": \"{{ticket.organization.notes}}\"\n   \t\t }\n    },\n    \"user\": {\n        \"external_id\": \"{{current_user.external_id}}\",\n\t\t\"id\": \"{{current_user.id}}\",\n\t\t\"name\": \"{{current_user.name}}\",\n\t\t\"first_name\": \"{{current_user.first_name}}\",\n\t\t\"last_name\": \"{{current_user.last_name}}\",\n\t\t\"email\": \"{{current_user.email}}\",\n\t\t\"details\": \"{{current_user.details}}\",        \n        \"notes\": \"{{current_user.notes}}\",\n        \"phone\": \"{{current_user.phone}}\",\n\t\t\"language\": \"{{current_user.language}}\",\n\t\t\"organization\":{\n\t\t  \"name\": \"{{current_user.organization.name}}\",\n\t\t  \"details\": \"{{current_user.organization.details}}\",\n\t\t  \"notes\": \"{{current_user.organization.notes}}\"\n\t\t}\n    }\n}".replace("TICKET_ACTION_TYPE", as_trigger["webhook_type"])],
-                        }],
-                        "conditions": exist_as_trigger[0]["conditions"],
-                        "category_id": "{}".format(category_id)
-                    }
+        reconcile_ticket_triggers(
+            self.instance_obj, webhook_id, category_id,
+            transformer_functions.iter_triggers(self.instance_obj))
+
+
+def provision_webhooks(instances_details, webhook_name, webhook_url,
+                       max_workers=None):
+    """Provision the AgilitySync webhook and triggers on many instances
+    concurrently. Returns one report per instance, in input order.
+    """
+    def provision(instance_details):
+        started = time.monotonic()
+        report = {
+            "url": instance_details["url"],
+            "email": instance_details["email"]
+        }
+        try:
+            instance = transformer_functions.connect(instance_details)
+            report["webhook_id"] = provision_webhook(instance, webhook_name, webhook_url)
+            report["status"] = "success"
+        except Exception as ex:
+            report["status"] = "failed"
+            report["error"] = str(ex)
+        report["elapsed"] = time.monotonic() - started
+        return report
+
+    if not instances_details:
+        return []
+
+    max_workers = min(max_workers or DEFAULT.PROVISIONING_WORKERS,
+                      len(instances_details))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(provision, instances_details))
+
+
+def provision_webhook(instance, webhook_name, webhook_url):
+    payload = {
+        "webhook": {
+            "endpoint": "{}".format(webhook_url),
+            "http_method": "POST",
+            "name": "{}".format(webhook_name),
+            "status": "active",
+            "request_format": "json",
+            "subscriptions": ["conditional_ticket_events"]
+        }
+    }  # Payload data to create single webhook
+
+    transformer_functions.invalidate_metadata(instance)
+
+    # Webhooks, trigger categories and triggers are independent reads.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        webhooks = executor.submit(transformer_functions.webhooks, instance)
+        trigger_categories = executor.submit(transformer_functions.trigger_categories, instance)
+        triggers = executor.submit(transformer_functions.triggers, instance)
+
+    webhook_data = find_webhook(webhooks.result(), webhook_name, webhook_url)  # Reusing registered webhook
+    if webhook_data is None:
+        webhook_data = transformer_functions.webhooks(instance,
+                                                      payload=payload)  # Creating webhook
+    category_id = ensure_trigger_category(instance, trigger_categories.result())  # Creating trigger category
+    reconcile_ticket_triggers(instance, webhook_data["id"], category_id,
+                              triggers.result())  # Creating triggers
+    return webhook_data["id"]
+
+
+def find_webhook(webhooks, webhook_name, webhook_url):
+    for webhook in webhooks:
+        if (webhook["name"] == webhook_name and
+                webhook["endpoint"] == webhook_url and
+                webhook["status"] == "active"):
+            return webhook
+    return None
+
+
+def ensure_trigger_category(instance, trigger_categories):
+    trigger_category_exist = None
+    for trigger_category in trigger_categories:
+        if trigger_category["name"] == DEFAULT.TRIGGER_CATEGORY_NAME:
+            trigger_category_exist = trigger_category
+            break
+
+    if trigger_category_exist:
+        # Trigger category exist return exist category id.
+        trigger_categories_id = trigger_category_exist["id"]
+        return trigger_categories_id
+    else:
+        # Trigger category does not exist creating it and return the new category id.
+        payload = {
+            "trigger_category": {
+                "name": "{}".format(DEFAULT.TRIGGER_CATEGORY_NAME),
+                "position": 0
+            }
+        }
+        catagory_data = transformer_functions.trigger_categories(instance, payload=payload)
+        return catagory_data["id"]
+
+
+def reconcile_ticket_triggers(instance, webhook_id, category_id, triggers):
+    as_trigger_titles = set(as_trigger["title"] for as_trigger in DEFAULT.AS_TRIGGERS)
+    exist_as_triggers = {}
+
+    # Stop scanning as soon as every AgilitySync trigger has been seen.
+    for trigger in triggers:
+        if (trigger["raw_title"] in as_trigger_titles and
+                trigger["raw_title"] not in exist_as_triggers):
+            exist_as_triggers[trigger["raw_title"]] = trigger
+            if len(exist_as_triggers) == len(as_trigger_titles):
+                break
+
+    # Only the compact payload depends on the instance's ticket fields.
+    ticket_fields = ()
+    if DEFAULT.WEBHOOK_PAYLOAD_PROFILE != "full":
+        ticket_fields = transformer_functions.cached_ticket_fields(instance)
+
+    for as_trigger in DEFAULT.AS_TRIGGERS:
+
+        exist_as_trigger = exist_as_triggers.get(as_trigger["title"])
+        webhook_action = trigger_webhook_action(webhook_id, as_trigger["webhook_type"],
+                                                ticket_fields)
+
+        if exist_as_trigger:
+            if is_trigger_current(exist_as_trigger, webhook_action, category_id):
+                continue
+
+            update_payload = {
+                "trigger": {
+                    "title": "{}".format(as_trigger["title"]),
+                    "actions": [webhook_action],
+                    "conditions": exist_as_trigger["conditions"],
+                    "category_id": "{}".format(category_id)
                 }
-                update_payload["trigger"]["actions"].extend(exist_as_trigger[0]["actions"])
-                transformer_functions.triggers(self.instance_obj,
-                exist_as_trigger[0]["id"], update_payload)
-            else:
-                create_payload = {
-                    "trigger": {
-                        "title": "{}".format(as_trigger["title"]),
-                        "actions": [{
-                            "field": "notification_webhook",
-                            "value": ["{}".format(webhook_id), "{\n    \"action\": \"TICKET_ACTION_TYPE\",\n\t\"ticket\": {\n        \"id\": \"{{ticket.id}}\",\n\t\t\"external_id\": \"{{ticket.external_id}}\",\n\t\t\"title\": \"{{ticket.title}}\",\n\t\t\"type\": \"{{ticket.ticket_type}}\",\n\t\t\"created_at_with_timestamp\": \"{{ticket.created_at_with_timestamp}}\",\n\t\t\"created_at_with_time\": \"{{ticket.created_at_with_time}}\",\n\t\t\"updated_at_with_time\": \"{{ticket.updated_at_with_time}}\",\n\t\t\"updated_at_with_timestamp\": \"{{ticket.updated_at_with_timestamp}}\",\n\t\t\"status\": \"{{ticket.status}}\",\n\t\t\"url\": \"{{ticket.url}}\",\n        \"description\": \"{{ticket.description}}\",\n        \"due_date\": \"{{ticket.due_date}}\",\n        \"priority\": \"{{ticket.priority}}\",\n        \"source\": \"{{ticket.via}}\",\n\t\t\"account\": \"{{ticket.account}}\",\n\t\t\"brand_name\": \"{{ticket.brand.name}}\",\n\t\t\"cc_names\": \"{{ticket.cc_names}}\",\n\t\t\"ccs\": \"{{ticket.ccs}}\",\n\t\t\"current_holiday_name\": \"{{ticket.current_holiday_name}}\",\n\t\t\"latest_comment_html\": \"{{ticket.latest_comment_html}}\",\n\t\t\"latest_public_comment_html\": \"{{ticket.latest_public_comment_html}}\",\n\t\t\"tags\": \"{{ticket.tags}}\",\n\t\t\"ticket_field_ID\": \"{{ticket.ticket_field_ID}}\",\n\t\t\"ticket_field_option_title_ID\": \"{{ticket.ticket_field_option_title_ID}}\",\n\t\t\"via\": \"{{ticket.via}}\",\n\t\t\"group\":{\n\t\t\t\"name\": \"{{ticket.group.name}}\"\t\n\t\t},\n\t\t\"requester\": {\n\t\t\t\"details\": \"{{ticket.requester.details}}\",\n\t\t\t\"email\": \"{{ticket.requester.email}}\",\n\t\t\t\"external_id\": \"{{ticket.requester.external_id}}\",\n\t\t\t\"first_name\": \"{{ticket.requester.first_name}}\",\n\t\t\t\"language\": \"{{ticket.requester.language}}\",\n\t\t\t\"last_name\": \"{{ticket.requester.last_name}}\",\n\t\t\t\"name\": \"{{ticket.requester.name}}\",\n\t\t\t\"phone\": \"{{ticket.requester.phone}}\",\n\t\t\t\"requester_field\": \"{{ticket.requester_field}}\"\n\t\t},\n\t\t\"assignee\": {\n            \"email\": \"{{ticket.assignee.email}}\",\n            \"name\": \"{{ticket.assignee.name}}\",\n            \"first_name\": \"{{ticket.assignee.first_name}}\",\n            \"last_name\": \"{{ticket.assignee.last_name}}\"\n    \t},\n\t\t\"organization\": {\n        \t\"name\": \"{{ticket.organization.name}}\",\n\t\t\t\"external_id\": \"{{ticket.organization.external_id}}\",\n\t\t\t\"details\": \"{{ticket.organization.details}}\",\n\t\t\t\"notes\": \"{{ticket.organization.notes}}\"\n   \t\t }\n    },\n    \"user\": {\n        \"external_id\": \"{{current_user.external_id}}\",\n\t\t\"id\": \"{{current_user.id}}\",\n\t\t\"name\": \"{{current_user.name}}\",\n\t\t\"first_name\": \"{{current_user.first_name}}\",\n\t\t\"last_name\": \"{{current_user.last_name}}\",\n\t\t\"email\": \"{{current_user.email}}\",\n\t\t\"details\": \"{{current_user.details}}\",        \n        \"notes\": \"{{current_user.notes}}\",\n        \"phone\": \"{{current_user.phone}}\",\n\t\t\"language\": \"{{current_user.language}}\",\n\t\t\"organization\":{\n\t\t  \"name\": \"{{current_user.organization.name}}\",\n\t\t  \"details\": \"{{current_user.organization.details}}\",\n\t\t  \"notes\": \"{{current_user.organization.notes}}\"\n\t\t}\n    }\n}".replace("TICKET_ACTION_TYPE", as_trigger["webhook_type"])],
-                        }],
-                        "conditions": {
-                            "any": [{
-                                "field": "update_type",
-                                "operator": "is",
-                                "value": as_trigger["conditions_value"]
-                            }]
-                        },
-                        "category_id": "{}".format(category_id)
-                    }
+            }
+            update_payload["trigger"]["actions"].extend(
+                action for action in exist_as_trigger["actions"]
+                if not is_webhook_action(action, webhook_id))
+            transformer_functions.triggers(instance,
+                                           exist_as_trigger["id"], update_payload)
+        else:
+            create_payload = {
+                "trigger": {
+                    "title": "{}".format(as_trigger["title"]),
+                    "actions": [webhook_action],
+                    "conditions": {
+                        "any": [{
+                            "field": "update_type",
+                            "operator": "is",
+                            "value": as_trigger["conditions_value"]
+                        }]
+                    },
+                    "category_id": "{}".format(category_id)
                 }
+            }
+
+            transformer_functions.triggers(instance,
+                                           payload=create_payload)
+
+
+def trigger_webhook_action(webhook_id, webhook_type, ticket_fields=()):
+    return {
+        "field": "notification_webhook",
+        "value": ["{}".format(webhook_id),
+                  trigger_payload(webhook_type, ticket_fields)]
+    }
+
+
+def is_webhook_action(action, webhook_id):
+    return (action.get("field") == "notification_webhook" and
+            str(action["value"][0]) == str(webhook_id))
 
-                transformer_functions.triggers(self.instance_obj,
-                                               payload=create_payload)
+
+def is_trigger_current(trigger, webhook_action, category_id):
+    """True when the existing trigger already notifies the webhook with the
+    canonical payload, so it does not need to be rewritten.
+    """
+    if str(trigger.get("category_id")) != str(category_id) or not trigger["actions"]:
+        return False
+
+    action = trigger["actions"][0]
+    if not is_webhook_action(action, webhook_action["value"][0]):
+        return False
+
+    try:
+        return json.loads(action["value"][1]) == json.loads(webhook_action["value"][1])
+    except (ValueError, TypeError, IndexError):
+        return False
@@ -0,0 +1,201 @@
+import functools
+import json
+import re
+import threading
+import time
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin import rate_limit
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+ID_SEGMENT_RE = re.compile(r"/\d+(?=/|$)")
+
+# Checked on every call; everything else is skipped while it is False.
+enabled = DEFAULT.METRICS_ENABLED
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+class Histogram(object):
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+def enable(flag=True):
+    global enabled
+    enabled = flag
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def observe(name, labels, seconds):
+    with _lock:
+        histogram = _histograms.get((name, labels))
+        if histogram is None:
+            histogram = _histograms[(name, labels)] = Histogram()
+        histogram.observe(seconds)
+
+
+def inc(name, labels, value=1):
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + value
+
+
+def endpoint(path):
+    """Path without query string or ids, e.g. api/v2/tickets/:id."""
+    return ID_SEGMENT_RE.sub("/:id", path.split("?", 1)[0])
+
+
+def payload_size(payload):
+    if payload is None:
+        return 0
+    return len(json.dumps(payload, default=str))
+
+
+def record_request(method, path, seconds, payload, response, failed):
+    """Latency and outcome of one call. The REST client only hands back
+    parsed JSON, so body sizes are estimates from re-serializing it, kept
+    under their own names and only with METRICS_PAYLOAD_ESTIMATES.
+    """
+    labels = (("endpoint", endpoint(path)), ("method", method))
+    observe("zendesk_request_seconds", labels, seconds)
+    inc("zendesk_requests_total", labels + (("status", "error" if failed else "ok"),))
+    if DEFAULT.METRICS_PAYLOAD_ESTIMATES:
+        inc("zendesk_request_bytes_out_estimate_total", labels, payload_size(payload))
+        inc("zendesk_request_bytes_in_estimate_total", labels, payload_size(response))
+
+
+def record_bytes(method, path, bytes_out, bytes_in):
+    """Body sizes measured on the wire, by transports that see them."""
+    labels = (("endpoint", endpoint(path)), ("method", method))
+    inc("zendesk_request_bytes_out_total", labels, bytes_out)
+    inc("zendesk_request_bytes_in_total", labels, bytes_in)
+
+
+def timed(name):
+    """Record latency and failures of a plugin entry point when enabled."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+
+            labels = (("entry_point", name),)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                inc("zendesk_entry_point_errors_total", labels)
+                raise
+            finally:
+                observe("zendesk_entry_point_seconds", labels, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """JSON serializable view of every metric, including rate limit headroom
+    and retries per instance.
+    """
+    with _lock:
+        histograms = [
+            {
+                "name": name,
+                "labels": dict(labels),
+                "buckets": dict(zip(LATENCY_BUCKETS, histogram.buckets)),
+                "count": histogram.count,
+                "sum": histogram.sum
+            }
+            for (name, labels), histogram in _histograms.items()
+        ]
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in _counters.items()
+        ]
+
+    instances = [
+        {"instance": "{}".format(key[0] if isinstance(key, tuple) else key),
+         "headroom": headroom, "retries": retries, "endpoint_retries": endpoint_retries}
+        for key, headroom, retries, endpoint_retries in rate_limit.snapshot()
+    ]
+
+    return {"histograms": histograms, "counters": counters, "rate_limits": instances}
+
+
+def prometheus():
+    """Snapshot in the Prometheus text exposition format, one "# TYPE" line
+    per metric family followed by all of its samples. 429 retries are
+    exported once, per instance and endpoint; retries of calls made without
+    an endpoint are counted under endpoint="other".
+    """
+    data = snapshot()
+    families = {}
+
+    def sample(name, metric_type, line):
+        families.setdefault(name, (metric_type, []))[1].append(line)
+
+    for histogram in data["histograms"]:
+        name = histogram["name"]
+        cumulative = 0
+        for bound, count in histogram["buckets"].items():
+            cumulative += count
+            sample(name, "histogram", "{}_bucket{} {}".format(
+                name, format_labels(histogram["labels"], le=bound), cumulative))
+        sample(name, "histogram", "{}_bucket{} {}".format(
+            name, format_labels(histogram["labels"], le="+Inf"), histogram["count"]))
+        sample(name, "histogram", "{}_sum{} {}".format(
+            name, format_labels(histogram["labels"]), histogram["sum"]))
+        sample(name, "histogram", "{}_count{} {}".format(
+            name, format_labels(histogram["labels"]), histogram["count"]))
+
+    for counter in data["counters"]:
+        sample(counter["name"], "counter", "{}{} {}".format(
+            counter["name"], format_labels(counter["labels"]), counter["value"]))
+
+    for instance in data["rate_limits"]:
+        sample("zendesk_rate_limit_headroom", "gauge", "zendesk_rate_limit_headroom{} {}".format(
+            format_labels({"instance": instance["instance"]}), instance["headroom"]))
+
+        endpoint_retries = dict(instance["endpoint_retries"])
+        other = instance["retries"] - sum(endpoint_retries.values())
+        if other:
+            endpoint_retries["other"] = other
+        for name, retries in sorted(endpoint_retries.items()):
+            sample("zendesk_request_retries_total", "counter",
+                   "zendesk_request_retries_total{} {}".format(
+                       format_labels({"instance": instance["instance"], "endpoint": name}), retries))
+
+    lines = []
+    for name, (metric_type, samples) in families.items():
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        lines.extend(samples)
+
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in sorted(labels.items())) + "}"
@@ -0,0 +1,405 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from external_plugins.zendesk_plugin import metrics
+from external_plugins.zendesk_plugin import rate_limit
+from external_plugins.zendesk_plugin import transformer_functions
+from external_plugins.zendesk_plugin.delta import synced_fields
+import external_plugins.zendesk_plugin.default as DEFAULT
+
+QUEUED = "queued"
+SENDING = "sending"
+DONE = "done"
+FAILED = "failed"
+
+CREATE = "create"
+UPDATE = "update"
+COMMENT = "comment"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL,
+    url TEXT NOT NULL,
+    email TEXT NOT NULL,
+    ticket_id TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    error TEXT,
+    owner TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS operations_pending ON operations (shard, status, seq);
+CREATE INDEX IF NOT EXISTS operations_ticket ON operations (url, ticket_id, seq);
+"""
+
+# Columns added after the first release, for journals created before them.
+ADDED_COLUMNS = [
+    ("owner", "TEXT"),
+    ("result", "TEXT")
+]
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def idempotency_key(url, operation, ticket_id, payload):
+    """Key for an outbound write: the instance, the operation, the ticket id
+    and a digest of the payload. Replaying the same write yields the same key.
+    """
+    data = json.dumps([url, operation, str(ticket_id), payload], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def backoff(attempts):
+    return min(DEFAULT.RATE_LIMIT_MAX_BACKOFF,
+               DEFAULT.RATE_LIMIT_BASE_BACKOFF * 2 ** attempts)
+
+
+def is_unknown_outcome(error):
+    """True when a failed write may still have been applied: no response
+    arrived (e.g. a timeout), the server failed, or Zendesk is still
+    processing the same Idempotency-Key.
+    """
+    status, _ = rate_limit.error_response(error)
+    return status is None or status == 409 or status >= 500
+
+
+class OutboundQueue(object):
+    """SQLite backed write-ahead queue for outbound Zendesk updates and
+    comments, drained by worker threads. Each ticket always maps to the same
+    worker, so writes to one ticket are applied in the order they were queued.
+
+    Creates are journaled as well but sent by the caller, which needs the new
+    ticket id; see :meth:`create`.
+    """
+
+    def __init__(self, path, workers):
+        self.path = path
+        self.workers = workers
+        self._local = threading.local()
+        self._instances = {}
+        self._wakeups = [threading.Event() for _ in range(workers)]
+        self._stopping = threading.Event()
+        self._threads = []
+        self.owner = "{}:{}".format(os.getpid(), uuid.uuid4().hex)
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db().executescript(SCHEMA)
+        self._migrate()
+        self._reshard()
+
+    def db(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def shard(self, ticket_id):
+        return zlib.crc32(str(ticket_id).encode("utf-8")) % self.workers
+
+    def register(self, instance_details):
+        key = (instance_details['url'], instance_details['email'])
+        is_new = key not in self._instances
+        self._instances[key] = instance_details
+
+        # Journaled writes of a newly registered instance can now be drained.
+        if is_new:
+            for wakeup in self._wakeups:
+                wakeup.set()
+
+    def start(self):
+        self.purge()
+        for shard in range(self.workers):
+            thread = threading.Thread(target=self._drain, args=(shard,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for wakeup in self._wakeups:
+            wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def enqueue(self, instance_details, ticket_id, operation, payload):
+        """Journal an update or comment. Returns False when the newest write
+        still waiting for the ticket is this same write.
+        """
+        self.register(instance_details)
+        key = idempotency_key(instance_details['url'], operation, ticket_id, payload)
+        shard = self.shard(ticket_id)
+        db = self.db()
+
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Only the newest waiting write counts as a duplicate: with a
+            # different write queued behind it, the same values must be
+            # written again to end up last.
+            newest = db.execute(
+                "SELECT idempotency_key, status FROM operations WHERE url = ? AND ticket_id = ?"
+                " ORDER BY seq DESC LIMIT 1",
+                (instance_details['url'], str(ticket_id))).fetchone()
+            if newest is not None and newest["status"] == QUEUED and newest["idempotency_key"] == key:
+                db.execute("COMMIT")
+                return False
+
+            db.execute(
+                "INSERT INTO operations (idempotency_key, url, email, ticket_id, shard,"
+                " operation, payload, status, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, instance_details['url'], instance_details['email'], str(ticket_id), shard,
+                 operation, json.dumps(payload), QUEUED, time.time()))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        self._wakeups[shard].set()
+        return True
+
+    def create(self, instance_details, payload):
+        """Create a ticket and return it. The create is journaled and sent
+        with an Idempotency-Key, which Zendesk honours for
+        OUTBOUND_IDEMPOTENCY_WINDOW seconds: resending the key returns the
+        ticket created the first time instead of a second one.
+
+        A create whose outcome is unknown (timeout, server error, crash) is
+        retried with the same key up to OUTBOUND_CREATE_ATTEMPTS times. When
+        it still fails, the key stays in the journal and the next create of
+        the same payload, e.g. the framework's retry, reuses it. Each such
+        key is reused by one later create only, so different work items with
+        equal fields still get a ticket each.
+        """
+        self.register(instance_details)
+        seq, key = self._claim_create(instance_details, json.dumps(payload, sort_keys=True))
+        db = self.db()
+
+        # The REST client only takes headers when it is built.
+        connection = transformer_functions.new_connection(
+            instance_details, {"Idempotency-Key": key})
+        try:
+            attempt = 0
+            while True:
+                try:
+                    ticket = transformer_functions.tickets(connection, payload=payload)
+                    break
+                except Exception as e:
+                    unknown = is_unknown_outcome(e)
+                    attempt += 1
+                    if unknown and attempt < DEFAULT.OUTBOUND_CREATE_ATTEMPTS:
+                        time.sleep(backoff(attempt - 1))
+                        continue
+
+                    db.execute("UPDATE operations SET status = ?, attempts = attempts + ?, error = ?"
+                               " WHERE seq = ?", (QUEUED if unknown else FAILED, attempt, str(e), seq))
+                    if not unknown and metrics.enabled:
+                        metrics.inc("zendesk_outbound_queue_failed_total", (("operation", CREATE),))
+                    raise
+        finally:
+            transformer_functions.close_connection(connection)
+
+        db.execute("UPDATE operations SET status = ?, attempts = attempts + ?, result = ?"
+                   " WHERE seq = ?", (DONE, attempt + 1, json.dumps(ticket), seq))
+        return ticket
+
+    def _claim_create(self, instance_details, payload):
+        # Reuse the key of an earlier create of this payload whose outcome is
+        # unknown and that nobody is sending, or journal a new one.
+        db = self.db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute(
+                "SELECT seq, idempotency_key, status, owner FROM operations"
+                " WHERE operation = ? AND url = ? AND email = ? AND payload = ?"
+                " AND status IN (?, ?) AND created > ? ORDER BY seq",
+                (CREATE, instance_details['url'], instance_details['email'], payload,
+                 QUEUED, SENDING, time.time() - DEFAULT.OUTBOUND_IDEMPOTENCY_WINDOW)).fetchall()
+            for row in rows:
+                if row["status"] == QUEUED or not self._owner_alive(row["owner"]):
+                    db.execute("UPDATE operations SET status = ?, owner = ? WHERE seq = ?",
+                               (SENDING, self.owner, row["seq"]))
+                    db.execute("COMMIT")
+                    return row["seq"], row["idempotency_key"]
+
+            key = uuid.uuid4().hex
+            cursor = db.execute(
+                "INSERT INTO operations (idempotency_key, url, email, ticket_id, shard,"
+                " operation, payload, status, created, owner)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, instance_details['url'], instance_details['email'], "", 0,
+                 CREATE, payload, SENDING, time.time(), self.owner))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return cursor.lastrowid, key
+
+    def _owner_alive(self, owner):
+        """False once the process that was sending a create has exited."""
+        if not owner:
+            return False
+        pid, token = owner.split(":", 1)
+        if int(pid) == os.getpid():
+            # An earlier queue of this process, or a recycled pid.
+            return owner == self.owner
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+        return True
+
+    def purge(self):
+        """Drop completed writes older than OUTBOUND_QUEUE_RETENTION, and
+        create keys Zendesk no longer honours.
+        """
+        now = time.time()
+        self.db().execute(
+            "DELETE FROM operations WHERE (status = ? AND created < ?)"
+            " OR (operation = ? AND status IN (?, ?) AND created < ?)",
+            (DONE, now - DEFAULT.OUTBOUND_QUEUE_RETENTION,
+             CREATE, QUEUED, SENDING, now - DEFAULT.OUTBOUND_IDEMPOTENCY_WINDOW))
+
+    def depth(self):
+        rows = self.db().execute(
+            "SELECT shard, COUNT(*) AS depth FROM operations WHERE status IN (?, ?)"
+            " AND operation != ? GROUP BY shard", (QUEUED, SENDING, CREATE))
+        return {row["shard"]: row["depth"] for row in rows}
+
+    def failed(self, limit=100):
+        """Writes given up after OUTBOUND_QUEUE_MAX_ATTEMPTS, newest first."""
+        rows = self.db().execute(
+            "SELECT seq, url, ticket_id, operation, payload, attempts, created, error"
+            " FROM operations WHERE status = ? ORDER BY seq DESC LIMIT ?", (FAILED, limit))
+        return [dict(row) for row in rows]
+
+    def _migrate(self):
+        db = self.db()
+        columns = set(row["name"] for row in db.execute("PRAGMA table_info(operations)"))
+        for name, column_type in ADDED_COLUMNS:
+            if name not in columns:
+                db.execute("ALTER TABLE operations ADD COLUMN {} {}".format(name, column_type))
+
+    def _reshard(self):
+        # The worker count may differ from the previous run.
+        db = self.db()
+        rows = db.execute("SELECT seq, ticket_id FROM operations WHERE status IN (?, ?)"
+                          " AND operation != ?", (QUEUED, SENDING, CREATE)).fetchall()
+        for row in rows:
+            db.execute("UPDATE operations SET shard = ? WHERE seq = ?",
+                       (self.shard(row["ticket_id"]), row["seq"]))
+
+    def _next(self, shard):
+        instances = list(self._instances)
+        if not instances:
+            return None
+
+        # Oldest write of the shard whose instance credentials are known.
+        condition = " OR ".join(["(url = ? AND email = ?)"] * len(instances))
+        params = [shard, QUEUED, SENDING, CREATE]
+        for url, email in instances:
+            params.extend([url, email])
+
+        return self.db().execute(
+            "SELECT * FROM operations WHERE shard = ? AND status IN (?, ?) AND operation != ?"
+            " AND ({}) ORDER BY seq LIMIT 1".format(condition), params).fetchone()
+
+    def _drain(self, shard):
+        wakeup = self._wakeups[shard]
+
+        with rate_limit.lane(rate_limit.BULK):
+            while not self._stopping.is_set():
+                row = self._next(shard)
+                if row is None:
+                    wakeup.wait(DEFAULT.OUTBOUND_QUEUE_POLL_INTERVAL)
+                    wakeup.clear()
+                    continue
+                self._apply(row)
+
+    def _apply(self, row):
+        db = self.db()
+        instance_details = self._instances[(row["url"], row["email"])]
+        payload = json.loads(row["payload"])
+
+        try:
+            instance = transformer_functions.connect(instance_details)
+            if row["operation"] == COMMENT and (row["status"] == SENDING or row["attempts"]):
+                # A previous attempt may have been applied before it timed
+                # out or the process crashed.
+                if comment_exists(instance, row["ticket_id"], payload):
+                    db.execute("UPDATE operations SET status = ? WHERE seq = ?", (DONE, row["seq"]))
+                    return
+
+            db.execute("UPDATE operations SET status = ?, attempts = attempts + 1 WHERE seq = ?",
+                       (SENDING, row["seq"]))
+            transformer_functions.tickets(instance, id=row["ticket_id"], payload=payload)
+            db.execute("UPDATE operations SET status = ? WHERE seq = ?", (DONE, row["seq"]))
+
+            # Only a write Zendesk accepted may make later identical values
+            # look unchanged to Outbound.update.
+            if row["operation"] == UPDATE and DEFAULT.OUTBOUND_DELTA_ENABLED:
+                synced_fields.record(row["url"], row["ticket_id"], payload["ticket"])
+
+        except Exception as e:
+            if row["attempts"] + 1 >= DEFAULT.OUTBOUND_QUEUE_MAX_ATTEMPTS:
+                db.execute("UPDATE operations SET status = ?, error = ? WHERE seq = ?",
+                           (FAILED, str(e), row["seq"]))
+                if metrics.enabled:
+                    metrics.inc("zendesk_outbound_queue_failed_total",
+                                (("operation", row["operation"]),))
+            else:
+                db.execute("UPDATE operations SET status = ?, error = ? WHERE seq = ?",
+                           (QUEUED, str(e), row["seq"]))
+                # Back off on this shard only; later writes to the ticket wait.
+                self._stopping.wait(backoff(row["attempts"]))
+
+
+def comment_exists(instance, ticket_id, payload):
+    body = payload["ticket"]["comment"]["body"]
+    comments = transformer_functions.paginate(
+        instance,
+        "tickets/{}/comments?sort_order=desc".format(ticket_id),
+        "comments",
+        page_size=DEFAULT.OUTBOUND_QUEUE_COMMENT_LOOKBACK)
+
+    for index, comment in enumerate(comments):
+        if comment.get("body") == body:
+            return True
+        if index + 1 >= DEFAULT.OUTBOUND_QUEUE_COMMENT_LOOKBACK:
+            break
+    return False
+
+
+def register(instance_details):
+    """Let the queue drain the journaled writes of an instance. The journal
+    holds no credentials, so writes left from a previous run are only sent
+    once the plugin connects to their instance again.
+    """
+    if DEFAULT.OUTBOUND_QUEUE_ENABLED:
+        get_queue().register(instance_details)
+
+
+def get_queue():
+    global _queue
+
+    with _queue_lock:
+        if _queue is None:
+            _queue = OutboundQueue(DEFAULT.OUTBOUND_QUEUE_PATH, DEFAULT.OUTBOUND_QUEUE_WORKERS)
+            _queue.start()
+        return _queue
@@ -0,0 +1,202 @@
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+_lane = threading.local()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+@contextmanager
+def lane(name):
+    """Run the enclosed Zendesk calls in the given priority lane."""
+    previous = current_lane()
+    _lane.name = name
+    try:
+        yield
+    finally:
+        _lane.name = previous
+
+
+def in_lane(name):
+    """Decorator form of :func:`lane`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with lane(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_lane():
+    return getattr(_lane, "name", INTERACTIVE)
+
+
+class TokenBucket(object):
+    """Per-instance token bucket. Bulk callers leave a reserve of tokens
+    untouched and give way while interactive callers are waiting.
+    """
+
+    def __init__(self, requests_per_minute, capacity):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.retries = 0
+        self.endpoint_retries = {}
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._interactive_waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, lane_name):
+        with self._condition:
+            interactive = lane_name != BULK
+            if interactive:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    wait = self._take(lane_name)
+                    if not wait:
+                        return
+                    self._condition.wait(wait)
+            finally:
+                if interactive:
+                    self._interactive_waiting -= 1
+                    self._condition.notify_all()
+
+    def try_acquire(self, lane_name):
+        """Take a token without blocking. Returns 0 when one was taken,
+        otherwise the seconds to wait before trying again; for callers that
+        must not block a thread, e.g. coroutines.
+        """
+        with self._condition:
+            return self._take(lane_name)
+
+    def _take(self, lane_name):
+        # Caller holds the condition.
+        interactive = lane_name != BULK
+        reserve = 0 if interactive else self.capacity * DEFAULT.RATE_LIMIT_INTERACTIVE_RESERVE
+        now = time.monotonic()
+        self._refill(now)
+
+        if (now >= self._paused_until and
+                self.tokens >= 1 + reserve and
+                (interactive or not self._interactive_waiting)):
+            self.tokens -= 1
+            return 0
+
+        return max(self._paused_until - now,
+                   (1 + reserve - self.tokens) / self.rate,
+                   0.01)
+
+    def pause(self, seconds, endpoint=None):
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.retries += 1
+            if endpoint is not None:
+                self.endpoint_retries[endpoint] = self.endpoint_retries.get(endpoint, 0) + 1
+
+    def observe(self, headers):
+        """Re-seed the bucket from Zendesk rate limit response headers."""
+        limit = _int_header(headers, "X-Rate-Limit")
+        remaining = _int_header(headers, "X-Rate-Limit-Remaining")
+
+        with self._condition:
+            if limit:
+                self.rate = limit / 60.0
+            if remaining is not None:
+                self._refill(time.monotonic())
+                self.tokens = min(self.tokens, remaining)
+
+    def headroom(self):
+        with self._condition:
+            self._refill(time.monotonic())
+            return self.tokens
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+def get_limiter(key):
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = TokenBucket(
+                DEFAULT.RATE_LIMIT_PER_MINUTE, DEFAULT.RATE_LIMIT_BURST)
+        return limiter
+
+
+def snapshot():
+    """(instance key, tokens available, 429 retries, 429 retries per
+    endpoint) for every instance.
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.items())
+    return [(key, limiter.headroom(), limiter.retries, dict(limiter.endpoint_retries))
+            for key, limiter in limiters]
+
+
+def call(key, func, endpoint=None):
+    """Run ``func`` once a token is available for ``key``, retrying on 429
+    with Retry-After or jittered exponential backoff. Retries are counted
+    per ``endpoint`` when one is given.
+    """
+    limiter = get_limiter(key)
+    attempt = 0
+
+    while True:
+        limiter.acquire(current_lane())
+        try:
+            return func()
+        except Exception as e:
+            status, headers = error_response(e)
+            if headers:
+                limiter.observe(headers)
+            if status != 429 or attempt >= DEFAULT.RATE_LIMIT_MAX_RETRIES:
+                raise
+
+            limiter.pause(retry_delay(headers, attempt), endpoint)
+            attempt += 1
+
+
+def error_response(error):
+    """(HTTP status, response headers) of a failed call; status is None when
+    no response was received, e.g. on a timeout.
+    """
+    # requests and ASyncRestApi errors carry a response; aiohttp errors
+    # carry status and headers themselves.
+    response = getattr(error, "response", None)
+    status = (getattr(response, "status_code", None) or getattr(error, "status_code", None) or
+              getattr(error, "status", None))
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    return status, headers
+
+
+def retry_delay(headers, attempt):
+    """Seconds to wait after a 429: Retry-After, or jittered exponential
+    backoff without it.
+    """
+    delay = _int_header(headers, "Retry-After")
+    if delay is None:
+        delay = random.uniform(0, min(DEFAULT.RATE_LIMIT_MAX_BACKOFF,
+                                      DEFAULT.RATE_LIMIT_BASE_BACKOFF * 2 ** attempt))
+    return delay
+
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
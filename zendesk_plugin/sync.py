@@ -10,29 +10,189 @@ from agilitysync.sync import (
     EventTypes,
     EventCategory
 )
+import functools
 import re
 from datetime import datetime
-from dateutil import parser
-import time
+from types import MappingProxyType
 from external_plugins.zendesk_plugin import transformer_functions
+from external_plugins.zendesk_plugin import async_transformer_functions
+from external_plugins.zendesk_plugin import attachments
+from external_plugins.zendesk_plugin import batching
+from external_plugins.zendesk_plugin import comments
+from external_plugins.zendesk_plugin import decode
+from external_plugins.zendesk_plugin import field_schema
+from external_plugins.zendesk_plugin import metrics
+from external_plugins.zendesk_plugin import outbound_queue
+from external_plugins.zendesk_plugin import rate_limit
+from external_plugins.zendesk_plugin import ticket_loader
+from external_plugins.zendesk_plugin.delta import synced_fields
+import external_plugins.zendesk_plugin.default as DEFAULT
+
+SKIPPED_OUTBOUND_FIELDS = frozenset(["Assignee"])  # Temp skip
+
+_field_plans = {}
+
+# "October 7, 2026 at 09:05", the Liquid rendering of updated_at_with_time.
+UPDATED_AT_WITH_TIME_RE = re.compile(r"([A-Za-z]+) (\d{1,2}), (\d{4}) at (\d{1,2}):(\d{2})$")
+
+MONTH_ABBREVIATIONS = {
+    "January": "Jan", "February": "Feb", "March": "Mar", "April": "Apr",
+    "May": "May", "June": "Jun", "July": "Jul", "August": "Aug",
+    "September": "Sep", "October": "Oct", "November": "Nov", "December": "Dec"
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def comment_header_pattern(updated_at_with_time):
+    """Text Zendesk prints in the comment header for the given update time,
+    for example "Oct 7, 2026, 09:05".
+    """
+    match = UPDATED_AT_WITH_TIME_RE.match(updated_at_with_time)
+    if match is None or match.group(1) not in MONTH_ABBREVIATIONS:
+        updated_at = datetime.strptime(updated_at_with_time, "%B %d, %Y at %H:%M")
+        return updated_at.strftime('%b %-d, %Y, %H:%M')
+
+    month, day, year, hour, minute = match.groups()
+    return "{} {}, {}, {:02d}:{}".format(
+        MONTH_ABBREVIATIONS[month], int(day), year, int(hour), minute)
+
+
+def is_comment_updated(updated_at_with_time, latest_public_comment_html):
+    # The update time only appears in the comment header, so the body
+    # beyond the first COMMENT_HEADER_SCAN_LENGTH characters is not scanned.
+    search_pattern = comment_header_pattern(updated_at_with_time)
+    return latest_public_comment_html.find(
+        search_pattern, 0, DEFAULT.COMMENT_HEADER_SCAN_LENGTH) != -1
+
+
+def is_sync_user_event(record):
+    """O(1) check for echoes of our own writes, done before any other
+    parsing of the payload.
+    """
+    return transformer_functions.is_sync_user(record.host, record.user_id)
+
+
+def latest_comment_html(ticket):
+    """latest_comment_html, or the public comment when the trigger uses the
+    compact payload profile.
+    """
+    return ticket.get("latest_comment_html", ticket["latest_public_comment_html"])
+
+
+def payload_comment(ticket):
+    """Newest comment text recovered from the rendered comment html."""
+    if "latest_comment_html" not in ticket and "latest_public_comment_html" not in ticket:
+        return ""
+    data = latest_comment_html(ticket)
+    data = data.replace("----------------------------------------------\n\n", "")
+    data = data.split("Attachment(s):\n")
+    return data[0]
+
+
+def event_categories(event):
+    category = []
+
+    event_type = event["action"]
+
+    if event_type in ('ticket_created', 'ticket_updated', 'ticket_deleted'):
+        category.append(EventCategory.WORKITEM)
+
+    if is_comment_updated(event["ticket"]["updated_at_with_time"], event["ticket"]["latest_public_comment_html"]):
+        category.append(EventCategory.COMMENT)
+
+        if "Attachment(s):" in latest_comment_html(event['ticket']):
+            category.append(EventCategory.ATTACHMENT)
+
+    return category
+
+
+def missing_field_values(instance, ticket):
+    """True when ``ticket`` lacks the value of a field the trigger payload
+    can carry.
+    """
+    compact = DEFAULT.WEBHOOK_PAYLOAD_PROFILE != "full"
+
+    for field in transformer_functions.cached_ticket_fields(instance):
+        key = field_schema.template_key(field)
+        # The full template cannot carry custom field values.
+        if key is None or (not compact and key.startswith("ticket_field_")):
+            continue
+        value = ticket
+        for part in key.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if value is None:
+            return True
+    return False
+
+
+class FieldPlan(object):
+    """Precompiled outbound transformation for one asset: the Zendesk field
+    name for every mapped field, or None for fields that are not synced.
+    """
+    __slots__ = ("asset", "targets")
+
+    def __init__(self, asset, field_names):
+        self.asset = asset
+        self.targets = MappingProxyType({
+            name: None if name in SKIPPED_OUTBOUND_FIELDS else name.lower()
+            for name in field_names
+        })
+
+
+def field_plan(asset, outbound_fields):
+    """Plan for ``asset`` covering every field in ``outbound_fields``. A plan
+    is compiled the first time a mapping is seen and replaced only when the
+    mapping gains a field.
+    """
+    plan = _field_plans.get(asset)
+    if plan is None or any(field.name not in plan.targets for field in outbound_fields):
+        field_names = set(plan.targets) if plan else set()
+        field_names.update(field.name for field in outbound_fields)
+        plan = _field_plans[asset] = FieldPlan(asset, field_names)
+    return plan
 
 
 class Payload(BasePayload):
+    _event = None
+    _record = None
+
+    def record(self, event):
+        """EventRecord of ``event``, kept until another event is passed in."""
+        if event is not self._event:
+            self._record = decode.record(event)
+            self._event = event
+        return self._record
 
     def fetch_project(self, event):
         return "no_project"
 
     def fetch_asset(self, event):
-        return event['ticket']["type"].lower()
+        return self.record(event).asset
 
     def is_cyclic_event(self, event, sync_user):
-        return bool(event['user']['id'] == str(sync_user))
+        record = self.record(event)
+        if is_sync_user_event(record):
+            return True
+
+        is_cyclic = bool(record.user_id == str(sync_user))
+        if is_cyclic:
+            transformer_functions.register_sync_user(event['ticket']['url'], sync_user)
+        else:
+            # Someone else changed the ticket, so the last synced values
+            # no longer describe it.
+            synced_fields.forget(event['ticket']['id'])
+        return is_cyclic
 
 
 class Event(BaseEvent):
 
+    @functools.cached_property
+    def record(self):
+        """EventRecord of self.event, built on first use."""
+        return decode.record(self.event)
+
     def fetch_event_type(self):
-        event_type = self.event['action']
+        event_type = self.record.action
 
         if event_type in ('ticket_created',):
             return EventTypes.CREATE
@@ -45,27 +205,29 @@ class Event(BaseEvent):
         raise as_exceptions.PayloadError(error_msg)
 
     def fetch_workitem_id(self):
-        return self.event['ticket']['id']
+        return self.record.workitem_id
 
     def fetch_workitem_display_id(self):
-        return self.event['ticket']['id']
+        return self.record.workitem_id
 
     def fetch_workitem_url(self):
-        return "/".join(self.event['ticket']['url'].split("/")[1:])
+        return self.record.url
 
     def fetch_revision(self):
-        return self.event['ticket']['updated_at_with_timestamp']
+        return self.record.revision
 
     def fetch_timestamp(self):
-        timestamp = parser.parse(self.event['ticket']["updated_at_with_timestamp"])
-
-        return datetime.fromtimestamp(time.mktime(timestamp.utctimetuple()))
+        return self.record.timestamp
 
 
 class Inbound(BaseInbound):
+    _new_comments = None
+    _event_completed = False
+
+    @metrics.timed("inbound.connect")
     def connect(self):
         try:
-            return transformer_functions.connect(
+            return async_transformer_functions.transport_connect(
                                                 self.instance_details
             )
         except Exception as e:
@@ -73,75 +235,156 @@ class Inbound(BaseInbound):
             raise as_exceptions.InboundError(error_msg, stack_trace=True)
 
     def is_comment_updated(self, updated_at_with_time, latest_public_comment_html):
-        updated_comment_epoch = datetime.strptime(updated_at_with_time, "%B %d, %Y at %H:%M").timestamp()
-        search_pattern = datetime.fromtimestamp(updated_comment_epoch).strftime('%b %-d, %Y, %H:%M')
-        found_pattern = re.search(search_pattern, latest_public_comment_html)
-        if found_pattern:
-            return True
-        else:
-            return False
+        return is_comment_updated(updated_at_with_time, latest_public_comment_html)
 
+    @metrics.timed("inbound.fetch_event_category")
     def fetch_event_category(self):
-        category = []
+        # The framework asks for the categories before it reads any field
+        # value of the event.
+        self.complete_event()
 
-        event_type = self.event["action"]
+        if "coalesced_categories" in self.event:
+            return list(self.event["coalesced_categories"])
 
-        if event_type in ('ticket_created', 'ticket_updated', 'ticket_deleted'):
-            category.append(EventCategory.WORKITEM)
+        return event_categories(self.event)
 
-        if self.is_comment_updated(self.event["ticket"]["updated_at_with_time"], self.event["ticket"]["latest_public_comment_html"]):
-            category.append(EventCategory.COMMENT)
+    @metrics.timed("inbound.fetch_comment")
+    def fetch_comment(self):
+        """Every comment added since the previous event on the ticket, as one
+        body. Several comments posted between two webhooks are joined with
+        COMMENT_BATCH_SEPARATOR, so the burst syncs in a single comment
+        instead of only the newest being seen.
+        """
+        return DEFAULT.COMMENT_BATCH_SEPARATOR.join(self.fetch_comments())
+
+    @metrics.timed("inbound.fetch_comments")
+    def fetch_comments(self):
+        """Comments added since the previous event on the ticket, oldest
+        first, leaving out comments written by the sync user. Falls back to
+        the newest comment in the webhook payload when the comments endpoint
+        cannot be read.
+        """
+        try:
+            instance = async_transformer_functions.transport_connect(self.instance_details)
+            batch = self.new_comments(instance)
+        except Exception:
+            comment = payload_comment(self.event['ticket'])
+            return [comment] if comment else []
+
+        return [comment.get("html_body") or comment.get("body", "") for comment in batch]
+
+    def new_comments(self, instance):
+        """Comments added since the previous event on the ticket, oldest
+        first and without the sync user's own. Read once and shared by
+        fetch_comments and fetch_attachments.
+        """
+        if self._new_comments is None:
+            ticket = self.event['ticket']
+            host = transformer_functions.instance_host(ticket['url'])
+            batch = comments.new_comments(instance, host, ticket['id'],
+                                          ticket.get('updated_at_with_timestamp'))
+            self._new_comments = [
+                comment for comment in batch
+                if not transformer_functions.is_sync_user(host, str(comment.get("author_id")))
+            ]
+        return self._new_comments
+
+    @metrics.timed("inbound.complete_event")
+    def complete_event(self):
+        """Fill in the field values the webhook payload left out, so the
+        values the framework reads from the event are there. Compact payloads
+        and catch-up events only carry part of the ticket; the rest comes
+        from tickets/show_many, and concurrent lookups share one request.
+        Values already in the payload are kept. Runs once per event.
+        """
+        ticket = self.event.get('ticket') if isinstance(self.event, dict) else None
+        if self._event_completed or not isinstance(ticket, dict):
+            return
 
-            if "Attachment(s):" in self.event['ticket']['latest_comment_html']:
-                category.append(EventCategory.ATTACHMENT)
+        try:
+            instance = async_transformer_functions.transport_connect(self.instance_details)
+            if missing_field_values(instance, ticket):
+                values = ticket_loader.load(instance, self.instance_details, ticket['id'])
+                if values is not None:
+                    ticket_loader.fill_missing(ticket, values)
+        except Exception as e:
+            error_msg = 'Unable to fetch ticket [{}]. Error is [{}].'.format(ticket.get('id'), str(e))
+            raise as_exceptions.InboundError(error_msg, stack_trace=True)
 
-        return category
+        self._event_completed = True
 
-    def fetch_comment(self):
-        comment_data = ""
-        if "latest_comment_html" in self.event["ticket"]:
-            data = self.event['ticket']['latest_comment_html']
-            data = data.replace("----------------------------------------------\n\n", "")
-            data = data.split("Attachment(s):\n")
-            comment_data = data[0]
-        return comment_data
+    @metrics.timed("inbound.fetch_attachments")
+    def fetch_attachments(self):
+        """Attachments of every comment fetch_comment returns."""
+        try:
+            instance = async_transformer_functions.transport_connect(self.instance_details)
+            return attachments.comment_attachments(self.instance_details,
+                                                   self.new_comments(instance))
+        except Exception as e:
+            error_msg = 'Unable to fetch attachments. Error is [{}].'.format(str(e))
+            raise as_exceptions.InboundError(error_msg, stack_trace=True)
 
 
 class Outbound(BaseOutbound):
 
+    @metrics.timed("outbound.connect")
     def connect(self):
         try:
-            return transformer_functions.connect(
+            outbound_queue.register(self.instance_details)
+            return async_transformer_functions.transport_connect(
                                                 self.instance_details
                                                 )
         except Exception as e:
             error_msg = 'Connection to Demo plugin failed.  Error is [{}].'.format(str(e))
             raise as_exceptions.OutboundError(error_msg, stack_trace=True)
 
+    @metrics.timed("outbound.transform_fields")
     def transform_fields(self, transfome_field_objs):
-        create_fields = {}
-
-        for outbound_field in transfome_field_objs:
-            field_name = outbound_field.name
+        try:
+            plan = field_plan(self.asset_info["asset"], transfome_field_objs)
+            targets = plan.targets
+            options = field_schema.option_index(self.instance_object)
+            create_fields = {}
 
-            if field_name in ["Assignee"]:  # Temp skip
-                continue
+            for outbound_field in transfome_field_objs:
+                target = targets[outbound_field.name]
+                if target is not None:
+                    # List fields take option values, not display names.
+                    create_fields[target] = options.translate(target, outbound_field.value)
 
-            field_value = outbound_field.value
-            create_fields[field_name.lower()] = field_value
+            create_fields["type"] = plan.asset
 
-        create_fields["type"] = self.asset_info["asset"]
+            return create_fields
 
-        return create_fields
+        except Exception as e:
+            error_msg = 'Unable to transform fields for Zendesk. Error is [{}].'.format(str(e))
+            raise as_exceptions.OutboundError(error_msg, stack_trace=True)
 
+    @metrics.timed("outbound.create")
+    @rate_limit.in_lane(rate_limit.BULK)
     def create(self, sync_fields):
         try:
             payload = {
                 "ticket": sync_fields
             }
 
-            ticket = transformer_functions.tickets(self.instance_object, payload=
-                                                   payload)
+            if DEFAULT.OUTBOUND_QUEUE_ENABLED:
+                ticket = outbound_queue.get_queue().create(self.instance_details, payload)
+            elif DEFAULT.OUTBOUND_BATCHING_ENABLED:
+                result = batching.write(self.instance_object, self.instance_details,
+                                        batching.CREATE, sync_fields)
+                ticket = {
+                    "id": result["id"],
+                    "external_id": sync_fields.get("external_id"),
+                    "type": sync_fields.get("type")
+                }
+            else:
+                ticket = transformer_functions.tickets(self.instance_object, payload=
+                                                       payload)
+            if DEFAULT.OUTBOUND_DELTA_ENABLED:
+                synced_fields.record(self.instance_details["url"],
+                                     ticket["id"], sync_fields)
+
             sync_info = {
                 "project": ticket["external_id"],
                 "issuetype": ticket["type"],
@@ -163,20 +406,44 @@ class Outbound(BaseOutbound):
                          "[{}]\n.".format(self.asset_info["display_name"], e, sync_fields))
             raise as_exceptions.OutboundError(error_msg, stack_trace=True)
 
+    @metrics.timed("outbound.update")
+    @rate_limit.in_lane(rate_limit.BULK)
     def update(self, sync_fields):
         try:
+            if DEFAULT.OUTBOUND_DELTA_ENABLED:
+                sync_fields = synced_fields.changed_fields(
+                    self.instance_details["url"], self.workitem_id, sync_fields)
+                if not sync_fields:
+                    return
+
             payload = {
                 "ticket": sync_fields
             }
 
-            transformer_functions.tickets(self.instance_object,
-                                          id=self.workitem_id, payload=payload)
+            if DEFAULT.OUTBOUND_QUEUE_ENABLED:
+                # The queue records the digests once Zendesk applied the write.
+                outbound_queue.get_queue().enqueue(
+                    self.instance_details, self.workitem_id, outbound_queue.UPDATE, payload)
+                return
+            elif DEFAULT.OUTBOUND_BATCHING_ENABLED:
+                ticket = dict(sync_fields, id=self.workitem_id)
+                batching.write(self.instance_object, self.instance_details,
+                               batching.UPDATE, ticket)
+            else:
+                transformer_functions.tickets(self.instance_object,
+                                              id=self.workitem_id, payload=payload)
+
+            if DEFAULT.OUTBOUND_DELTA_ENABLED:
+                synced_fields.record(self.instance_details["url"],
+                                     self.workitem_id, sync_fields)
 
         except Exception as e:
-            error_msg = ('Unable to sync fields in Jira. Error is [{}]. Trying to sync fields \n'
-                         '[{} {}]\n.'.format(e, sync_fields['create_fields'], sync_fields['update_fields']))
+            error_msg = ('Unable to sync fields in Zendesk. Error is [{}]. Trying to sync fields \n'
+                         '[{}]\n.'.format(e, sync_fields))
             raise as_exceptions.OutboundError(error_msg, stack_trace=True)
 
+    @metrics.timed("outbound.comment_create")
+    @rate_limit.in_lane(rate_limit.BULK)
     def comment_create(self, comment):
         try:
             payload = {
@@ -187,8 +454,44 @@ class Outbound(BaseOutbound):
                 }
             }
 
+            if DEFAULT.OUTBOUND_QUEUE_ENABLED:
+                outbound_queue.get_queue().enqueue(
+                    self.instance_details, self.workitem_id, outbound_queue.COMMENT, payload)
+            elif DEFAULT.OUTBOUND_BATCHING_ENABLED:
+                ticket = dict(payload["ticket"], id=self.workitem_id)
+                batching.write(self.instance_object, self.instance_details,
+                               batching.UPDATE, ticket)
+            else:
+                transformer_functions.tickets(self.instance_object,
+                                              id=self.workitem_id, payload=payload)
+        except Exception as e:
+            error_msg = 'Unable to sync comment. Error is [{}]. The comment is [{}]'.format(str(e), comment)
+            raise as_exceptions.OutboundError(error_msg, stack_trace=True)
+
+    @metrics.timed("outbound.attachment_create")
+    @rate_limit.in_lane(rate_limit.BULK)
+    def attachment_create(self, attachment_list):
+        try:
+            uploads = attachments.transfer_all(self.instance_object, self.instance_details,
+                                               self.workitem_id, attachment_list)
+            if not uploads:
+                return
+
+            payload = {
+                "ticket": {
+                    "comment": {
+                        "body": DEFAULT.ATTACHMENT_COMMENT_BODY,
+                        "uploads": [token for token, _ in uploads]
+                    }
+                }
+            }
+
             transformer_functions.tickets(self.instance_object,
                                           id=self.workitem_id, payload=payload)
+            # Only files on a saved comment count as attached.
+            attachments.mark_synced(self.instance_details, self.workitem_id,
+                                    [content_hash for _, content_hash in uploads])
         except Exception as e:
-            error_msg = 'Unable to sync comment. Error is [{}]. The comment is [{}]'.format(str(e), comment)
+            error_msg = 'Unable to sync attachments. Error is [{}]. The attachments are [{}]'.format(
+                str(e), [attachment.get("filename") for attachment in attachment_list])
             raise as_exceptions.OutboundError(error_msg, stack_trace=True)
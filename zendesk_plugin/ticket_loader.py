@@ -0,0 +1,163 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from external_plugins.zendesk_plugin import transformer_functions
+from external_plugins.zendesk_plugin.timestamps import with_time
+import external_plugins.zendesk_plugin.default as DEFAULT
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+
+class TicketLoader(object):
+    """Collects ticket lookups from concurrent callers for up to
+    TICKET_LOADER_WINDOW seconds and fetches them with one
+    tickets/show_many request. Results are template_ticket values.
+    """
+
+    def __init__(self, instance, host):
+        self.instance = instance
+        self.host = host
+        self._pending = {}
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._worker = None
+
+    def submit(self, ticket_id):
+        key = str(ticket_id)
+
+        with self._condition:
+            # Concurrent lookups of the same ticket share one future.
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._condition.notify()
+
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._pending:
+                    self._condition.wait(DEFAULT.TICKET_LOADER_WINDOW)
+                    if not self._pending:
+                        self._worker = None
+                        return
+
+                deadline = self._oldest + DEFAULT.TICKET_LOADER_WINDOW
+                while len(self._pending) < DEFAULT.TICKET_LOADER_BATCH_SIZE:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = list(self._pending.items())[:DEFAULT.TICKET_LOADER_BATCH_SIZE]
+                for key, _ in batch:
+                    del self._pending[key]
+                self._oldest = time.monotonic() if self._pending else None
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            response = transformer_functions.tickets_by_id(
+                self.instance, [key for key, _ in batch], DEFAULT.TICKET_LOADER_SIDELOADS)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for key, future in batch:
+            # Deleted or inaccessible tickets are left out of the response.
+            ticket = response["tickets"].get(key)
+            future.set_result(template_ticket(self.host, ticket, response) if ticket else None)
+
+
+def get_loader(instance, instance_details):
+    key = (instance_details['url'], instance_details['email'])
+
+    with _loaders_lock:
+        loader = _loaders.get(key)
+        if loader is None:
+            loader = _loaders[key] = TicketLoader(
+                instance, transformer_functions.instance_host(instance_details['url']))
+        else:
+            loader.instance = instance
+        return loader
+
+
+def load(instance, instance_details, ticket_id):
+    """template_ticket values for ``ticket_id``, or None when the ticket no
+    longer exists.
+    """
+    return get_loader(instance, instance_details).submit(ticket_id).result()
+
+
+def template_ticket(host, ticket, sideloads=None):
+    """An API ticket in the shape of the webhook "ticket" object, i.e. under
+    the WEBHOOK_PAYLOAD_TEMPLATE keys and rendered the way Liquid renders
+    them. Group, requester, assignee, organization and brand names come from
+    the id keyed ``sideloads`` (see tickets_by_id) and are left out when the
+    sideload is missing. Comment blobs are not part of a ticket.
+    """
+    sideloads = sideloads or {}
+
+    def related(plural, id):
+        if plural not in sideloads:
+            return None
+        return sideloads[plural].get(str(id)) or {}
+
+    values = {
+        "id": str(ticket["id"]),
+        "external_id": ticket.get("external_id") or "",
+        "title": ticket.get("subject") or "",
+        "type": ticket.get("type") or "",
+        "status": ticket.get("status") or "",
+        "url": "{}/agent/tickets/{}".format(host, ticket["id"]),
+        "description": ticket.get("description") or "",
+        "created_at_with_timestamp": ticket["created_at"],
+        "created_at_with_time": with_time(ticket["created_at"]),
+        "updated_at_with_time": with_time(ticket["updated_at"]),
+        "updated_at_with_timestamp": ticket["updated_at"],
+        "due_date": ticket.get("due_at") or "",
+        "priority": ticket.get("priority") or "",
+        "tags": " ".join(ticket.get("tags") or []),
+        "via": (ticket.get("via") or {}).get("channel") or "",
+        "source": (ticket.get("via") or {}).get("channel") or ""
+    }
+    for field in ticket.get("custom_fields") or []:
+        value = field.get("value")
+        if isinstance(value, list):
+            value = " ".join(value)
+        values["ticket_field_{}".format(field["id"])] = "" if value is None else value
+
+    for key, plural, id, attributes in (
+            ("group", "groups", ticket.get("group_id"), ("name",)),
+            ("requester", "users", ticket.get("requester_id"), ("name", "email", "external_id")),
+            ("assignee", "users", ticket.get("assignee_id"), ("name", "email")),
+            ("organization", "organizations", ticket.get("organization_id"), ("name", "external_id"))):
+        record = related(plural, id)
+        if record is not None:
+            values[key] = {attribute: record.get(attribute) or "" for attribute in attributes}
+
+    brand = related("brands", ticket.get("brand_id"))
+    if brand is not None:
+        values["brand_name"] = brand.get("name") or ""
+    return values
+
+
+def fill_missing(target, values):
+    """Copy every key of ``values`` that ``target`` lacks, recursing into
+    nested objects. Keys already in ``target`` are never overwritten.
+    """
+    for key, value in values.items():
+        if key not in target:
+            target[key] = value
+        elif isinstance(value, dict) and isinstance(target[key], dict):
+            fill_missing(target[key], value)
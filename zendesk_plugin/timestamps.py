@@ -0,0 +1,25 @@
+import functools
+import time
+from datetime import datetime
+
+from dateutil import parser
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_timestamp(value):
+    """Naive UTC datetime for updated_at_with_timestamp. The common
+    "2026-10-07T09:05:12Z" form is sliced directly instead of going through
+    dateutil.
+    """
+    if len(value) == 20 and value[4] == "-" and value[10] == "T" and value[19] == "Z":
+        return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+    timestamp = parser.parse(value)
+    return datetime.fromtimestamp(time.mktime(timestamp.utctimetuple()))
+
+
+def with_time(timestamp):
+    """Render a timestamp the way {{ticket.updated_at_with_time}} does."""
+    value = parse_timestamp(timestamp)
+    return "{} {}, {} at {:%H:%M}".format(value.strftime("%B"), value.day, value.year, value)
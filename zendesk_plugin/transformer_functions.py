@@ -1,10 +1,72 @@
 import base64
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin.cache import TTLCache
+from external_plugins.zendesk_plugin import metrics
+from external_plugins.zendesk_plugin import rate_limit
 from agilitysync.external_lib.restapi import ASyncRestApi
 
+# Process-wide pool of REST clients keyed by (url, email), most recently
+# used last. Reusing the client keeps its HTTP session alive between calls.
+_connection_pool = OrderedDict()
+_connection_pool_lock = threading.Lock()
+
+# (url, email) of every client handed out, used to key per-instance caches.
+_instance_keys = weakref.WeakKeyDictionary()
+
+_metadata_cache = TTLCache(DEFAULT.METADATA_CACHE_TTL,
+                           DEFAULT.METADATA_CACHE_SIZE)
+
+_user_id_cache = TTLCache(DEFAULT.USER_CACHE_TTL, DEFAULT.USER_CACHE_SIZE)
+
+# (host, user id) of the integration users, used to drop echo events
+# without looking at the rest of the payload.
+_sync_user_ids = set()
+
 
 def connect(instance_details):
+    if DEFAULT.CONNECTION_POOL_SIZE <= 0:
+        return new_connection(instance_details)
+
+    key = (instance_details['url'], instance_details['email'])
+    now = time.monotonic()
+
+    with _connection_pool_lock:
+        evicted = evict_idle_connections(now)
+
+        pooled = _connection_pool.get(key)
+        if pooled and pooled["password"] == instance_details['password']:
+            pooled["last_used"] = now
+            _connection_pool.move_to_end(key)
+            connection = pooled["connection"]
+        else:
+            if pooled:
+                # The password changed; the old client is not reused.
+                evicted.append(pooled["connection"])
+            connection = new_connection(instance_details)
+            _connection_pool[key] = {
+                "connection": connection,
+                "password": instance_details['password'],
+                "last_used": now
+            }
+            _connection_pool.move_to_end(key)
+
+            while len(_connection_pool) > DEFAULT.CONNECTION_POOL_SIZE:
+                evicted.append(_connection_pool.popitem(last=False)[1]["connection"])
+
+    # Sessions are closed outside the lock; closing may block on sockets.
+    for client in evicted:
+        close_connection(client)
+    return connection
+
+
+def new_connection(instance_details, extra_headers=None):
     token = "Basic " + encode_to_base64_string(
         instance_details['email'],
         instance_details['password']
@@ -15,8 +77,84 @@ def connect(instance_details):
         'Content-Type': 'application/json',
         "Accept": "application/json",
     }
-
-    return ASyncRestApi(instance_details['url'], headers=header)
+    header.update(extra_headers or {})
+
+    connection = ASyncRestApi(instance_details['url'], headers=header)
+    register_instance(connection, instance_details['url'], instance_details['email'])
+    return connection
+
+
+def register_instance(connection, url, email):
+    _instance_keys[connection] = (url, email)
+
+
+def request(instance, method, path, payload=None):
+    """Single entry point for every Zendesk REST call, scheduled through the
+    per-instance rate limiter.
+    """
+    func = getattr(instance, method)
+    args = (path,) if payload is None else (path, payload)
+    return send(instance, method, path, lambda: func(*args), payload)
+
+
+def send(instance, method, path, func, payload=None):
+    """Run ``func``, a call to ``path`` made outside the REST client (e.g. a
+    streamed upload), through the rate limiter of ``instance`` with 429
+    retries and request metrics. ``func`` may be called more than once.
+    """
+    if not metrics.enabled:
+        return rate_limit.call(instance_key(instance), func)
+
+    started = time.perf_counter()
+    response = None
+    failed = True
+    try:
+        response = rate_limit.call(instance_key(instance), func, metrics.endpoint(path))
+        failed = False
+        return response
+    finally:
+        metrics.record_request(method, path, time.perf_counter() - started,
+                               payload, response, failed)
+
+
+def instance_key(instance):
+    return _instance_keys.get(instance, id(instance))
+
+
+def evict_idle_connections(now=None):
+    """Drop pooled connections idle for longer than the configured timeout
+    and return them; the caller closes them with close_connection once the
+    pool lock, which it must hold, is released.
+    """
+    now = time.monotonic() if now is None else now
+    idle_keys = [
+        key for key, pooled in _connection_pool.items()
+        if now - pooled["last_used"] > DEFAULT.CONNECTION_IDLE_TIMEOUT
+    ]
+    return [_connection_pool.pop(key)["connection"] for key in idle_keys]
+
+
+def close_connection(connection):
+    """Close the HTTP session behind a client that left the pool. Clients
+    without a close method, or a session that has one, hold nothing open.
+    """
+    for owner in (connection, getattr(connection, "session", None)):
+        close = getattr(owner, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                # A client that fails to close is dropped all the same.
+                pass
+            return
+
+
+def reset_connection_pool():
+    with _connection_pool_lock:
+        connections = [pooled["connection"] for pooled in _connection_pool.values()]
+        _connection_pool.clear()
+    for connection in connections:
+        close_connection(connection)
 
 
 def encode_to_base64_string(email, password):
@@ -34,7 +172,7 @@ def check_connection(instance):
             DEFAULT.REST_ENDPOINT_VERSION,
             instance_path)
 
-    response = instance.get(path)
+    response = request(instance, "get", path)
 
     if "organizations" in response:
         return "Connection to Zendesk server is successfull."
@@ -50,12 +188,13 @@ def tickets(instance, id=None, payload=None):
         instance_path)
 
     if payload:
-        response = (instance.put(path, payload)
-                    if id else instance.post(path, payload))
+        response = (request(instance, "put", path, payload)
+                    if id else request(instance, "post", path, payload))
         return response["ticket"]
     else:
-        response = instance.get(path)
-        return response["tickets"]
+        if id:
+            return request(instance, "get", path)["ticket"]
+        return list(iter_tickets(instance))
 
 
 def ticket_fields(instance, id=None, payload=None):
@@ -67,13 +206,69 @@ def ticket_fields(instance, id=None, payload=None):
 
     if payload:
         if id:
-            response = instance.put(path, payload)
+            response = request(instance, "put", path, payload)
         else:
-            response = instance.post(path, payload)
+            response = request(instance, "post", path, payload)
+        invalidate_metadata(instance)
         return response["ticket_field"]
     else:
-        response = instance.get(path)
-        return response["ticket_fields"]
+        if id:
+            return request(instance, "get", path)["ticket_field"]
+        return list(iter_ticket_fields(instance))
+
+
+def first_ticket(instance):
+    return next(iter_tickets(instance, page_size=1), None)
+
+
+def cached_ticket_fields(instance):
+    return _metadata_cache.get_or_load(
+        (instance_key(instance), "ticket_fields"),
+        lambda: ticket_fields(instance))
+
+
+def cached_first_ticket(instance):
+    return _metadata_cache.get_or_load(
+        (instance_key(instance), "first_ticket"),
+        lambda: first_ticket(instance))
+
+
+def invalidate_metadata(instance):
+    key = instance_key(instance)
+    _metadata_cache.invalidate_where(lambda cache_key: cache_key[0] == key)
+
+
+def metadata_cache_stats():
+    return _metadata_cache.stats()
+
+
+def cached_user_id_by_email(instance, email):
+    def load():
+        user = get_user_by_email(instance, email)
+        return user["results"][0]["id"]
+
+    return _user_id_cache.get_or_load((instance_key(instance), email.lower()), load)
+
+
+def user_cache_stats():
+    return _user_id_cache.stats()
+
+
+def instance_host(url):
+    """Host name of an instance url or of a Liquid rendered ticket.url,
+    which has no scheme.
+    """
+    if "//" not in url:
+        url = "//" + url
+    return urlsplit(url).hostname or url
+
+
+def register_sync_user(url, user_id):
+    _sync_user_ids.add((instance_host(url), str(user_id)))
+
+
+def is_sync_user(host, user_id):
+    return (host, user_id) in _sync_user_ids
 
 
 def get_user_by_email(instance, email):
@@ -83,7 +278,7 @@ def get_user_by_email(instance, email):
         DEFAULT.REST_ENDPOINT_VERSION,
         instance_path)
 
-    response = instance.get(path)
+    response = request(instance, "get", path)
     return response
 
 
@@ -96,13 +291,14 @@ def webhooks(instance, id=None, payload=None):
 
     if payload:
         if id:
-            response = instance.put(path, payload)
+            response = request(instance, "put", path, payload)
         else:
-            response = instance.post(path, payload)
+            response = request(instance, "post", path, payload)
         return response["webhook"]
     else:
-        response = instance.get(path)
-        return response["webhooks"]
+        if id:
+            return request(instance, "get", path)["webhook"]
+        return list(iter_webhooks(instance))
 
 
 def trigger_categories(instance, id=None, payload=None):
@@ -115,11 +311,12 @@ def trigger_categories(instance, id=None, payload=None):
         instance_path)
 
     if payload:
-        response = instance.post(path, payload)
+        response = request(instance, "post", path, payload)
         return response["trigger_category"]
     else:
-        response = instance.get(path)
-        return response["trigger_categories"]
+        if id:
+            return request(instance, "get", path)["trigger_category"]
+        return list(iter_trigger_categories(instance))
 
 
 def triggers(instance, id=None, payload=None):
@@ -132,9 +329,180 @@ def triggers(instance, id=None, payload=None):
         instance_path)
 
     if payload:
-        response = (instance.put(path, payload) if
-                    id else instance.post(path, payload))
+        response = (request(instance, "put", path, payload) if
+                    id else request(instance, "post", path, payload))
         return response["trigger"]
     else:
-        response = instance.get(path)
-        return response["triggers"]
+        if id:
+            return request(instance, "get", path)["trigger"]
+        return list(iter_triggers(instance))
+
+
+def tickets_create_many(instance, tickets_payload):
+    path = "{}/{}/{}".format(
+        DEFAULT.INITIAL_PATH,
+        DEFAULT.REST_ENDPOINT_VERSION,
+        "tickets/create_many")
+
+    response = request(instance, "post", path, {"tickets": tickets_payload})
+    return response["job_status"]
+
+
+def tickets_update_many(instance, tickets_payload):
+    path = "{}/{}/{}".format(
+        DEFAULT.INITIAL_PATH,
+        DEFAULT.REST_ENDPOINT_VERSION,
+        "tickets/update_many")
+
+    response = request(instance, "put", path, {"tickets": tickets_payload})
+    return response["job_status"]
+
+
+def job_statuses(instance, id):
+    path = "{}/{}/{}".format(
+        DEFAULT.INITIAL_PATH,
+        DEFAULT.REST_ENDPOINT_VERSION,
+        "job_statuses/{}".format(id))
+
+    response = request(instance, "get", path)
+    return response["job_status"]
+
+
+def tickets_show_many(instance, ids, include=None):
+    instance_path = "tickets/show_many?ids={}".format(",".join(str(id) for id in ids))
+    if include:
+        instance_path = "{}&include={}".format(instance_path, ",".join(include))
+    path = "{}/{}/{}".format(
+        DEFAULT.INITIAL_PATH,
+        DEFAULT.REST_ENDPOINT_VERSION,
+        instance_path)
+
+    return request(instance, "get", path)
+
+
+def tickets_by_id(instance, ids, include=None):
+    """Fetch many tickets by id with tickets/show_many, SHOW_MANY_LIMIT ids
+    per request and up to BULK_READ_WORKERS requests in parallel.
+
+    Returns {"tickets": {id: ticket}} plus one id-keyed map per sideload in
+    ``include`` (e.g. "users", "groups"). Ids that no longer exist are
+    missing from the tickets map.
+    """
+    ids = list(OrderedDict.fromkeys(str(id) for id in ids))
+    include = list(include or [])
+    chunks = [ids[start:start + DEFAULT.SHOW_MANY_LIMIT]
+              for start in range(0, len(ids), DEFAULT.SHOW_MANY_LIMIT)]
+
+    result = {"tickets": {}}
+    for key in include:
+        result[key] = {}
+    if not chunks:
+        return result
+
+    # Worker threads inherit the caller's priority lane.
+    lane_name = rate_limit.current_lane()
+
+    def fetch(chunk):
+        with rate_limit.lane(lane_name):
+            return tickets_show_many(instance, chunk, include)
+
+    workers = min(DEFAULT.BULK_READ_WORKERS, len(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for response in executor.map(fetch, chunks):
+            for key in result:
+                for record in response.get(key) or []:
+                    result[key][str(record["id"])] = record
+
+    return result
+
+
+def paginate(instance, instance_path, key, page_size=None):
+    """Yield the records of a list endpoint one at a time, following Zendesk
+    cursor pagination. Only one page is held in memory.
+    """
+    separator = "&" if "?" in instance_path else "?"
+    path = "{}/{}/{}{}page[size]={}".format(
+        DEFAULT.INITIAL_PATH,
+        DEFAULT.REST_ENDPOINT_VERSION,
+        instance_path,
+        separator,
+        page_size or DEFAULT.PAGE_SIZE)
+
+    while path:
+        response = request(instance, "get", path)
+
+        for record in response[key]:
+            yield record
+
+        if "meta" in response:
+            has_more = response["meta"].get("has_more")
+            path = relative_path(response["links"]["next"]) if has_more else None
+        else:
+            # Endpoints without cursor support fall back to offset pagination.
+            next_page = response.get("next_page")
+            path = relative_path(next_page) if next_page else None
+
+
+def last_audit(instance, ticket_id):
+    """Newest audit of a ticket, or None when it has none."""
+    audits = paginate(instance, "tickets/{}/audits?sort_order=desc".format(ticket_id),
+                      "audits", page_size=1)
+    return next(audits, None)
+
+
+def relative_path(url):
+    parts = urlsplit(url)
+    path = parts.path.lstrip("/")
+    return "{}?{}".format(path, parts.query) if parts.query else path
+
+
+def iter_tickets(instance, page_size=None):
+    return paginate(instance, "tickets", "tickets", page_size)
+
+
+def iter_ticket_fields(instance, page_size=None):
+    return paginate(instance, "ticket_fields", "ticket_fields", page_size)
+
+
+def iter_webhooks(instance, page_size=None):
+    return paginate(instance, "webhooks", "webhooks", page_size)
+
+
+def iter_trigger_categories(instance, page_size=None):
+    return paginate(instance, "trigger_categories", "trigger_categories", page_size)
+
+
+def iter_triggers(instance, page_size=None):
+    return paginate(instance, "triggers", "triggers", page_size)
+
+
+def incremental_ticket_pages(instance, start_time=None, cursor=None, include=None):
+    """Yield (tickets, after_cursor, sideloads) for each page of the
+    incremental ticket export, starting at ``cursor`` or, without one, at
+    ``start_time``. ``sideloads`` holds the records of every sideload named
+    in ``include`` (e.g. "last_audits").
+    """
+    if cursor:
+        instance_path = "incremental/tickets/cursor?cursor={}".format(cursor)
+    else:
+        instance_path = "incremental/tickets/cursor?start_time={}".format(int(start_time))
+
+    path = "{}/{}/{}".format(
+        DEFAULT.INITIAL_PATH,
+        DEFAULT.REST_ENDPOINT_VERSION,
+        instance_path)
+    include = list(include or [])
+
+    while path:
+        # after_url does not carry the include parameter forward.
+        if include and "include=" not in path:
+            path = "{}&include={}".format(path, ",".join(include))
+
+        response = request(instance, "get", path)
+        sideloads = {key: response.get(key) or [] for key in include}
+        yield response["tickets"], response["after_cursor"], sideloads
+
+        if response.get("end_of_stream") or not response.get("after_url"):
+            path = None
+        else:
+            path = relative_path(response["after_url"])
@@ -0,0 +1,158 @@
+import logging
+import multiprocessing
+import queue
+import traceback
+import zlib
+
+import external_plugins.zendesk_plugin.default as DEFAULT
+from external_plugins.zendesk_plugin import decode
+from external_plugins.zendesk_plugin.cache import TTLCache
+
+_STOP = None
+
+logger = logging.getLogger(__name__)
+
+
+def ticket_key(event):
+    """(host, ticket id) of a webhook event; ids are only unique per host."""
+    return event['ticket']['url'].split("/", 1)[0], str(event['ticket']['id'])
+
+
+def _work(handler, events, depth, processed, dropped, failed, failures):
+    revisions = TTLCache(DEFAULT.INBOUND_REVISION_TTL, DEFAULT.INBOUND_REVISION_SIZE)
+
+    while True:
+        event = events.get()
+        if event is _STOP:
+            return
+
+        key = None
+        try:
+            key = ticket_key(event)
+            revision = decode.record(event).timestamp
+            last = revisions.get(key)
+
+            # A newer revision of the ticket was already processed.
+            if last is not None and revision < last:
+                counter = dropped
+            else:
+                revisions.set(key, revision)
+                handler(event)
+                counter = processed
+        except Exception as e:
+            counter = failed
+            logger.exception("Inbound worker failed to handle the event of ticket %s.", key)
+            try:
+                failures.put_nowait({"ticket": key, "error": repr(e),
+                                     "traceback": traceback.format_exc()})
+            except queue.Full:
+                # The parent is not reading failures; the log line remains.
+                pass
+
+        with counter.get_lock():
+            counter.value += 1
+        with depth.get_lock():
+            depth.value -= 1
+
+
+class ShardedInboundPool(object):
+    """Runs ``handler(event)`` for webhook events in worker processes.
+
+    Events of one ticket always go to the same process, so they are handled
+    in arrival order and an event older than one already handled is dropped.
+    Different tickets are handled in parallel. ``handler`` must be picklable,
+    for example a module level function. Handler exceptions are logged in
+    the worker and passed back to the parent, see :meth:`failures`.
+    """
+
+    def __init__(self, handler, processes=None, queue_size=None, context=None):
+        context = context or multiprocessing.get_context()
+        self.processes = processes or DEFAULT.INBOUND_WORKER_PROCESSES
+        queue_size = queue_size or DEFAULT.INBOUND_WORKER_QUEUE_SIZE
+
+        self._queues = [context.Queue(queue_size) for _ in range(self.processes)]
+        self._depths = [context.Value("l", 0) for _ in range(self.processes)]
+        self._counters = {
+            name: [context.Value("l", 0) for _ in range(self.processes)]
+            for name in ("processed", "dropped", "failed")
+        }
+        self._failures = context.Queue(DEFAULT.INBOUND_WORKER_FAILURES_SIZE)
+        self._workers = [
+            context.Process(
+                target=_work,
+                args=(handler, self._queues[shard], self._depths[shard],
+                      self._counters["processed"][shard],
+                      self._counters["dropped"][shard],
+                      self._counters["failed"][shard],
+                      self._failures),
+                daemon=True)
+            for shard in range(self.processes)
+        ]
+        self._closed = False
+
+        for worker in self._workers:
+            worker.start()
+
+    def shard(self, event):
+        return zlib.crc32("/".join(ticket_key(event)).encode("utf-8")) % self.processes
+
+    def submit(self, event, timeout=None):
+        """Queue an event on its ticket's shard. Blocks while the shard queue
+        is full; raises queue.Full if ``timeout`` seconds pass first.
+        """
+        if self._closed:
+            raise RuntimeError("The inbound worker pool is closed.")
+
+        shard = self.shard(event)
+        with self._depths[shard].get_lock():
+            self._depths[shard].value += 1
+        try:
+            self._queues[shard].put(event, timeout=timeout)
+        except Exception:
+            with self._depths[shard].get_lock():
+                self._depths[shard].value -= 1
+            raise
+        return shard
+
+    def depth(self):
+        """Events queued or in progress per shard."""
+        return {shard: depth.value for shard, depth in enumerate(self._depths)}
+
+    def failures(self):
+        """Events whose handler raised since the last call, oldest first, as
+        {"ticket": (host, id), "error": ..., "traceback": ...}. At most
+        INBOUND_WORKER_FAILURES_SIZE are kept between calls.
+        """
+        result = []
+        while True:
+            try:
+                result.append(self._failures.get_nowait())
+            except queue.Empty:
+                return result
+
+    def stats(self):
+        stats = {name: sum(counter.value for counter in counters)
+                 for name, counters in self._counters.items()}
+        stats["depth"] = self.depth()
+        return stats
+
+    def close(self, timeout=None):
+        """Stop accepting events and wait for every queued event to be
+        handled before the workers exit.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        for events in self._queues:
+            events.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout)
+        for events in self._queues:
+            events.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()